@@ -1,5 +1,9 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
+from medi_tg_analytics.db.pool import health_check
+
+from .db import engine
 from .routers import reports, channels, search
 
 app = FastAPI(
@@ -20,3 +24,13 @@ def root():
         "status": "running",
         "docs": "/docs"
     }
+
+
+@app.get("/health")
+def health():
+    # Check the engine that serves the API routes, not the loaders' pool
+    database = health_check(engine)
+    return JSONResponse(
+        status_code=200 if database["ok"] else 503,
+        content={"status": "ok" if database["ok"] else "degraded", "database": database},
+    )
@@ -11,6 +11,7 @@ with detections as (
 image_flags as (
 
     select
+        channel_name,
         message_id,
 
         max(case when detected_class = 'person' then 1 else 0 end) as has_person,
@@ -25,12 +26,13 @@ image_flags as (
         ) as has_product
 
     from detections
-    group by message_id
+    group by channel_name, message_id
 ),
 
 classified_images as (
 
     select
+        channel_name,
         message_id,
 
         case
@@ -45,11 +47,15 @@ classified_images as (
 
 messages as (
 
+    -- message ids are only unique within a channel
     select
-        message_id,
-        channel_key,
-        date_key
-    from {{ ref('fct_messages') }}
+        f.message_id,
+        ch.channel_name,
+        f.channel_key,
+        f.date_key
+    from {{ ref('fct_messages') }} f
+    join {{ ref('dim_channels') }} ch
+        on f.channel_key = ch.channel_key
 
 )
 
@@ -65,6 +71,8 @@ select
 
 from detections d
 join classified_images c
-    on d.message_id = c.message_id
+    on d.channel_name = c.channel_name
+    and d.message_id = c.message_id
 join messages m
-    on d.message_id = m.message_id
+    on d.channel_name = m.channel_name
+    and d.message_id = m.message_id
@@ -19,7 +19,10 @@ select
     case
         when coalesce(has_media, false) then true
         else false
-    end as has_image
+    end as has_image,
+    ingested_at,
+    -- Bumped whenever the loader refreshes view/forward counts
+    coalesce(updated_at, ingested_at) as updated_at
 from source
 where
     -- Only include messages with non-empty text OR with media
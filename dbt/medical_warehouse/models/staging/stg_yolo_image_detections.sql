@@ -1,7 +1,47 @@
 {{ config(materialized='view') }}
 
+with source as (
+    select
+        cast(message_id as bigint) as message_id,
+        lower(trim(channel_name)) as channel_name,
+        lower(detected_class) as detected_class,
+        cast(confidence_score as numeric(5,4)) as confidence_score,
+        model_version,
+        ingested_at
+    from {{ source('raw', 'yolo_image_detections') }}
+),
+
+-- raw.yolo_image_detections keeps one result per image and model
+-- version; downstream models must only see the most recently loaded one,
+-- or an image run through two models is counted twice
+current_versions as (
+    select
+        channel_name,
+        message_id,
+        model_version
+    from (
+        select
+            channel_name,
+            message_id,
+            model_version,
+            row_number() over (
+                partition by channel_name, message_id
+                order by max(ingested_at) desc, model_version desc
+            ) as version_rank
+        from source
+        group by channel_name, message_id, model_version
+    ) ranked
+    where version_rank = 1
+)
+
 select
-    cast(message_id as bigint) as message_id,
-    lower(detected_class) as detected_class,
-    cast(confidence_score as numeric(5,4)) as confidence_score
-from {{ source('raw', 'yolo_image_detections') }}
+    s.message_id,
+    s.channel_name,
+    s.detected_class,
+    s.confidence_score,
+    s.model_version
+from source s
+join current_versions v
+    on s.channel_name = v.channel_name
+    and s.message_id = v.message_id
+    and s.model_version is not distinct from v.model_version
@@ -0,0 +1,8 @@
+-- Detections of an image must come from a single model version
+select
+    channel_name,
+    message_id,
+    count(distinct coalesce(model_version, '')) as model_versions
+from {{ ref('stg_yolo_image_detections') }}
+group by channel_name, message_id
+having count(distinct coalesce(model_version, '')) > 1
@@ -0,0 +1,8 @@
+-- Telegram message ids are only unique within a channel
+select
+    channel_name,
+    message_id,
+    count(*) as row_count
+from {{ ref('stg_telegram_messages') }}
+group by channel_name, message_id
+having count(*) > 1
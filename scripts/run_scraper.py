@@ -31,7 +31,8 @@ print("🟢 Starting Telegram scraping...")
 # Redirect stdout and stderr to the log file
 with open(LOG_FILE, "a") as f:
     process = subprocess.Popen(
-        [sys.executable, "-m", "medi_tg_analytics.scraping.scraper"],
+        # Forward flags such as --full-refresh to the scraper
+        [sys.executable, "-m", "medi_tg_analytics.scraping.scraper", *sys.argv[1:]],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         universal_newlines=True,
@@ -0,0 +1,226 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+from medi_tg_analytics.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# ------------------------------------------------------------------
+# Configuration
+# ------------------------------------------------------------------
+
+ENV_KEYS = {
+    "host": "DB_HOST",
+    "port": "DB_PORT",
+    "dbname": "DB_NAME",
+    "user": "DB_USER",
+    "password": "DB_PASSWORD",
+}
+
+
+def db_config(config: Dict = None) -> Dict:
+    """
+    Resolved ``database`` section of config/database.yaml.
+
+    Connection parameters come from the DB_* env vars, falling back to
+    the YAML; DB_POOL_MIN / DB_POOL_MAX override the pool size.
+    """
+    cfg = dict(settings.get("database", {}) if config is None else config)
+    for key, env in ENV_KEYS.items():
+        if os.getenv(env):
+            cfg[key] = os.getenv(env)
+
+    pool_cfg = dict(cfg.get("pool", {}))
+    pool_cfg["min_connections"] = int(
+        os.getenv("DB_POOL_MIN") or pool_cfg.get("min_connections", 1)
+    )
+    pool_cfg["max_connections"] = int(
+        os.getenv("DB_POOL_MAX") or pool_cfg.get("max_connections", 8)
+    )
+    cfg["pool"] = pool_cfg
+    return cfg
+
+
+def connect_kwargs(cfg: Dict) -> Dict:
+    kwargs = {key: cfg.get(key) for key in ENV_KEYS}
+    kwargs["connect_timeout"] = cfg.get("connect_timeout", 10)
+    kwargs["application_name"] = cfg.get("application_name", "medi_tg_analytics")
+    return kwargs
+
+
+def session_settings(profile: str = "default", cfg: Dict = None) -> Dict[str, str]:
+    sessions = (cfg or db_config()).get("sessions", {})
+    if profile not in sessions and profile != "default":
+        raise ValueError(
+            f"Unknown session profile {profile!r}; expected one of {sorted(sessions)}"
+        )
+    return {name: str(value) for name, value in (sessions.get(profile) or {}).items()}
+
+
+def apply_session(conn, profile: str = "default", cfg: Dict = None) -> None:
+    """SET the profile's session settings and commit them."""
+    values = session_settings(profile, cfg)
+    if not values:
+        return
+    with conn.cursor() as cur:
+        for name, value in values.items():
+            cur.execute(sql.SQL("SET {} = %s").format(sql.Identifier(name)), (value,))
+    # A SET inside a transaction that is later rolled back is undone
+    conn.commit()
+
+
+# ------------------------------------------------------------------
+# Pool
+# ------------------------------------------------------------------
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """
+    The connection pool of the current process, created on first use.
+
+    A pool inherited through ``fork`` shares sockets with its parent, so
+    a child process (a loader worker) always builds its own.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            cfg = db_config()
+            try:
+                _pool = ThreadedConnectionPool(
+                    cfg["pool"]["min_connections"],
+                    cfg["pool"]["max_connections"],
+                    **connect_kwargs(cfg),
+                )
+            except psycopg2.Error as e:
+                raise RuntimeError(f"Failed to connect to PostgreSQL: {e}")
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def connection(profile: str = "default") -> Iterator:
+    """
+    Borrow a pooled connection tuned for ``profile``.
+
+    The caller owns the transaction: whatever is not committed when the
+    block ends is rolled back. Session settings are reset before the
+    connection goes back to the pool; temp tables survive for reuse.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        apply_session(conn, profile)
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("RESET ALL;")
+            conn.commit()
+            pool.putconn(conn)
+        except psycopg2.Error:
+            # Dead or broken connection: drop it instead of pooling it
+            pool.putconn(conn, close=True)
+
+
+def get_connection(profile: str = "default"):
+    """A new, unpooled connection for callers that manage its lifetime."""
+    cfg = db_config()
+    try:
+        conn = psycopg2.connect(**connect_kwargs(cfg))
+    except psycopg2.Error as e:
+        raise RuntimeError(f"Failed to connect to PostgreSQL: {e}")
+    apply_session(conn, profile, cfg)
+    return conn
+
+
+def health_check(engine=None) -> Dict:
+    """
+    Round-trip a query over the pool, or over the SQLAlchemy ``engine``
+    when one is given (the API checks the engine its requests use);
+    never raises.
+
+    The result is served by the unauthenticated ``/health`` endpoint, so
+    a failure only reports a fixed error code; the driver's message,
+    which can name the host, port, user or database, is logged instead.
+    """
+    start = time.perf_counter()
+    try:
+        if engine is not None:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("SELECT 1;").scalar()
+        else:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                    cur.fetchone()
+    except Exception as exc:
+        logger.warning(f"Database health check failed: {exc}")
+        return {"ok": False, "error": "database_unavailable"}
+    return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+# ------------------------------------------------------------------
+# SQLAlchemy
+# ------------------------------------------------------------------
+
+_engine = None
+
+
+def get_engine():
+    """Process-wide SQLAlchemy engine sized and tuned from the same config."""
+    global _engine
+    if _engine is None:
+        from sqlalchemy import create_engine
+        from sqlalchemy.engine import URL
+
+        cfg = db_config()
+        options = " ".join(
+            f"-c {name}={value}"
+            for name, value in session_settings("default", cfg).items()
+        )
+        url = URL.create(
+            "postgresql+psycopg2",
+            username=cfg.get("user"),
+            password=cfg.get("password"),
+            host=cfg.get("host"),
+            port=int(cfg["port"]) if cfg.get("port") else None,
+            database=cfg.get("dbname"),
+        )
+        _engine = create_engine(
+            url,
+            pool_pre_ping=True,
+            # max_connections caps this engine like the psycopg2 pool;
+            # SQLAlchemy's default overflow would allow 10 more
+            pool_size=cfg["pool"]["max_connections"],
+            max_overflow=0,
+            connect_args={
+                "connect_timeout": cfg.get("connect_timeout", 10),
+                "application_name": cfg.get("application_name", "medi_tg_analytics"),
+                **({"options": options} if options else {}),
+            },
+        )
+    return _engine
@@ -0,0 +1,105 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from medi_tg_analytics.utils.files import atomic_write_json, file_sha256
+
+logger = logging.getLogger(__name__)
+
+Detections = Tuple[List[str], List[float]]
+
+
+class DetectionCache:
+    """
+    Persistent YOLO results, so a nightly run only infers new images.
+
+    Results are keyed by image content hash and tagged with the model
+    ``fingerprint`` (weights name plus inference thresholds); an entry
+    made under another fingerprint is a miss and is overwritten on the
+    next store. Image paths map to their hash through a (size, mtime_ns)
+    stat cache, so unchanged images are never re-read.
+
+    Each path also remembers the version of the rows last published for
+    it (``mark_published``), so an incremental sink only needs the paths
+    whose rows are missing or out of date.
+
+    The cache is a JSON document rewritten atomically by ``save``.
+    """
+
+    def __init__(self, index_path: Path, root: Path, fingerprint: str):
+        self.index_path = Path(index_path)
+        self.root = Path(root)
+        self.fingerprint = fingerprint
+        # relative path -> [size, mtime_ns, sha256(, published version)]
+        self._files: Dict[str, list] = {}
+        # sha256 -> {"model": fingerprint, "detections": [[class, conf], ...]}
+        self._detections: Dict[str, Dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._files = dict(data.get("files", {}))
+            self._detections = dict(data.get("detections", {}))
+        except Exception as exc:
+            logger.warning(f"Ignoring unreadable detection cache {self.index_path}: {exc}")
+
+    def key(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    def content_hash(self, path: Path) -> str:
+        path = Path(path)
+        stat = path.stat()
+        key = self.key(path)
+        entry = self._files.get(key)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, file_sha256(path)]
+            self._files[key] = entry
+        return entry[2]
+
+    def get(self, path: Path) -> Optional[Detections]:
+        """Cached detections of ``path`` under the current fingerprint."""
+        entry = self._detections.get(self.content_hash(path))
+        if entry is None or entry.get("model") != self.fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        pairs = entry["detections"]
+        return [cls for cls, _ in pairs], [conf for _, conf in pairs]
+
+    def put(self, path: Path, detected: List[str], confidences: List[float]) -> None:
+        self._detections[self.content_hash(path)] = {
+            "model": self.fingerprint,
+            "detections": [[cls, conf] for cls, conf in zip(detected, confidences)],
+        }
+
+    def is_published(self, path: Path, version: str) -> bool:
+        """Whether rows of ``version`` were published for ``path`` as it is now."""
+        self.content_hash(path)
+        entry = self._files[self.key(path)]
+        return len(entry) > 3 and entry[3] == version
+
+    def mark_published(self, paths: Iterable[Path], version: str) -> None:
+        for path in paths:
+            entry = self._files.get(self.key(path))
+            if entry is not None:
+                entry[3:] = [version]
+
+    def prune(self, paths: Iterable[Path]) -> None:
+        """Forget images that are no longer on disk (everything but ``paths``)."""
+        keep = {self.key(p) for p in paths}
+        self._files = {k: v for k, v in self._files.items() if k in keep}
+        hashes = {entry[2] for entry in self._files.values()}
+        self._detections = {
+            h: v for h, v in self._detections.items() if h in hashes
+        }
+
+    def save(self) -> None:
+        data = {"files": self._files, "detections": self._detections}
+        atomic_write_json(self.index_path, data)
@@ -0,0 +1,194 @@
+import io
+import csv
+import logging
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Column order of every sink; matches raw.yolo_image_detections
+DETECTION_COLUMNS = [
+    "message_id",
+    "channel_name",
+    "detected_class",
+    "confidence_score",
+    "image_category",
+    "model_version",
+]
+
+# (message_id, channel_name, model_version) of an image
+ImageKey = Tuple[str, str, str]
+
+
+class DetectionSink:
+    """
+    Destination for the detection rows of an enrichment run.
+
+    Rows arrive in chunks through ``write``, together with the keys of
+    the images they belong to (an image without detections has a key but
+    no rows); nothing is visible to readers until ``commit``. ``abort``
+    discards a partial run and is a no-op after ``commit``.
+
+    A full sink receives every image of the run. An ``incremental`` one
+    only receives the images whose rows it does not have yet or that
+    changed since; their rows replace whatever it held for them.
+    """
+
+    name = ""
+    incremental = False
+
+    def open(self) -> "DetectionSink":
+        return self
+
+    def write(self, rows: List[Dict], images: List[ImageKey]) -> None:
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        pass
+
+
+class CsvSink(DetectionSink):
+    """``yolo_image_detections.csv``, written to a temp file and renamed into place."""
+
+    name = "csv"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.temp_file = self.path.with_name(self.path.name + ".tmp")
+        self.count = 0
+        self._fh = None
+        self._writer = None
+
+    def open(self) -> "CsvSink":
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.temp_file, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._fh, fieldnames=DETECTION_COLUMNS)
+        self._writer.writeheader()
+        return self
+
+    def write(self, rows: List[Dict], images: List[ImageKey]) -> None:
+        self._writer.writerows(rows)
+        self.count += len(rows)
+
+    def commit(self) -> None:
+        self._fh.close()
+        self._fh = None
+        self.temp_file.replace(self.path)
+        logger.info("Saved %d detections to %s", self.count, self.path)
+
+    def abort(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+            self.temp_file.unlink(missing_ok=True)
+
+
+class PostgresSink(DetectionSink):
+    """
+    COPY rows straight into ``raw.yolo_image_detections``.
+
+    Chunks are streamed into the loader's session-local shadow tables as
+    they arrive and published in one statement on ``commit``: the staged
+    images' rows replace the ones they had under the same model version,
+    or, with ``full_refresh``, the whole table is swapped for the staged
+    rows (see ``loading.yolo_csv_to_db``). Each chunk is committed to the
+    temp tables right away, so no transaction stays open while inference
+    runs.
+    """
+
+    name = "postgres"
+
+    def __init__(self, full_refresh: bool = False):
+        self.full_refresh = full_refresh
+        self.incremental = not full_refresh
+        self.images = 0
+        self._stack = None
+        self._conn = None
+        self._cur = None
+
+    def open(self) -> "PostgresSink":
+        from medi_tg_analytics.db.pool import connection
+        from medi_tg_analytics.loading.yolo_csv_to_db import prepare_tables
+
+        self._stack = ExitStack()
+        self._conn = self._stack.enter_context(connection("bulk"))
+        self._cur = self._conn.cursor()
+        prepare_tables(self._cur)
+        self._conn.commit()
+        return self
+
+    def write(self, rows: List[Dict], images: List[ImageKey]) -> None:
+        from medi_tg_analytics.loading.yolo_csv_to_db import (
+            IMAGE_COLUMNS,
+            copy_to_stage,
+        )
+
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, fieldnames=DETECTION_COLUMNS).writerows(rows)
+        buffer.seek(0)
+        copy_to_stage(self._cur, buffer, DETECTION_COLUMNS, header=False)
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(images)
+        buffer.seek(0)
+        self.images += copy_to_stage(
+            self._cur, buffer, IMAGE_COLUMNS, header=False, table="_stage_yolo_images"
+        )
+        self._conn.commit()
+
+    def commit(self) -> None:
+        from medi_tg_analytics.loading.yolo_csv_to_db import publish_stage, write_flag
+
+        published = publish_stage(
+            self._cur, "full_refresh" if self.full_refresh else "replace_images"
+        )
+        self._conn.commit()
+        self._close()
+        write_flag()
+        if self.full_refresh:
+            logger.info("Replaced detections with %d rows", published)
+        else:
+            logger.info(
+                "Published %d detections of %d new or changed images to "
+                "raw.yolo_image_detections",
+                published,
+                self.images,
+            )
+
+    def abort(self) -> None:
+        # Committed chunks live on in the pooled session's temp tables
+        # until the next prepare_tables; empty them now
+        if self._cur is not None:
+            try:
+                self._conn.rollback()
+                self._cur.execute(
+                    "TRUNCATE _stage_yolo_image_detections, _stage_yolo_images;"
+                )
+                self._conn.commit()
+            except Exception as exc:
+                logger.warning("Could not clear the detection stage: %s", exc)
+        self._close()
+
+    def _close(self) -> None:
+        if self._stack is not None:
+            self._stack.close()
+            self._stack = None
+            self._conn = self._cur = None
+
+
+SINKS = {
+    "csv": CsvSink,
+    "postgres": PostgresSink,
+}
+
+
+def make_sink(name: str, csv_path: Path, full_refresh: bool = False) -> DetectionSink:
+    if name == "csv":
+        return CsvSink(csv_path)
+    if name == "postgres":
+        return PostgresSink(full_refresh=full_refresh)
+    raise ValueError(f"Unknown sink {name!r}; expected one of {sorted(SINKS)}")
@@ -1,11 +1,23 @@
-import csv
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
 import logging
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
 
-from ultralytics import YOLO
+import numpy as np
 
 from medi_tg_analytics.core.settings import settings
+from medi_tg_analytics.enrichment.detection_cache import DetectionCache
+from medi_tg_analytics.enrichment.sinks import DetectionSink, make_sink
+from medi_tg_analytics.utils.files import file_sha256
 
 # --------------------------------------------------
 # Paths
@@ -13,34 +25,145 @@ from medi_tg_analytics.core.settings import settings
 
 IMAGES_DIR = settings.paths.DATA["raw_dir"] / "images"
 OUTPUT_DIR = settings.paths.DATA["interim_dir"]
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+MODELS_DIR = settings.paths.DATA["models_dir"]
 
 OUTPUT_CSV = OUTPUT_DIR / "yolo_image_detections.csv"
+CACHE_PATH = OUTPUT_DIR / "yolo_detection_cache.json"
+# Partial results of sharded runs, merged and removed by the parent
+SHARD_DIR = OUTPUT_DIR / "yolo_shards"
 
 LOG_DIR = settings.paths.LOGS["enrichment_logs_dir"]
-LOG_DIR.mkdir(parents=True, exist_ok=True)
 
-# --------------------------------------------------
-# Logging
-# --------------------------------------------------
-
-logging.basicConfig(
-    filename=LOG_DIR / "yolo_detect.log",
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-)
 logger = logging.getLogger(__name__)
 
 # --------------------------------------------------
 # YOLO setup
 # --------------------------------------------------
 
-MODEL_NAME = "yolov8n.pt"
-model = YOLO(MODEL_NAME)
+YOLO_CFG = settings.get("yolo", {})
+MODEL_NAME = YOLO_CFG.get("model", "yolov8n.pt")
+# Where detections go: postgres (raw.yolo_image_detections) and/or csv
+SINK_NAMES = list(YOLO_CFG.get("sinks") or ["postgres"])
+# Detection rows handed to the sinks per write
+SINK_BATCH_ROWS = 5000
+# Images per model call
+BATCH_SIZE = int(YOLO_CFG.get("batch_size", 16))
+# Thresholds passed to every model call; conf is the minimum confidence
+PREDICT_ARGS = {
+    "conf": float(YOLO_CFG.get("conf", 0.25)),
+    "iou": float(YOLO_CFG.get("iou", 0.7)),
+}
 
 PERSON_CLASSES = {"person"}
 PRODUCT_CLASSES = {"bottle", "cup", "bowl", "jar"}
 
+# Class allow-list (names) applied inside the model, so other classes
+# never reach NMS. The classes classify_image looks at are always kept;
+# an empty list keeps every class.
+CLASSES = (
+    sorted(set(YOLO_CFG["classes"]) | PERSON_CLASSES | PRODUCT_CLASSES)
+    if YOLO_CFG.get("classes")
+    else None
+)
+# Rows written per image, most confident first (None keeps all)
+MAX_DETECTIONS = YOLO_CFG.get("max_detections")
+# Images are read and decoded on a thread pool, this many batches ahead
+DECODE_WORKERS = int(YOLO_CFG.get("decode_workers", 4))
+PREFETCH_BATCHES = int(YOLO_CFG.get("prefetch_batches", 2))
+# Inference processes (1 = in-process) and torch threads for each of them
+WORKERS = int(YOLO_CFG.get("workers", 1))
+THREADS_PER_WORKER = YOLO_CFG.get("threads_per_worker")
+# "torch" runs the weights as they are. Any other value is an ultralytics
+# export format (onnx, openvino, ...): the weights are exported once into
+# MODELS_DIR and inference runs on that runtime instead.
+BACKEND = YOLO_CFG.get("backend", "torch")
+# Dynamic input axes let one export serve every batch size
+EXPORT_ARGS = {"dynamic": True, **(YOLO_CFG.get("export_args") or {})}
+
+_model = None
+
+
+def exported_model(backend: str = None) -> Path:
+    """
+    ``MODEL_NAME`` exported to ``backend``, exporting it on first use.
+
+    Exports are cached in ``MODELS_DIR`` under a key of the weights
+    content, the export arguments and the ultralytics version, so
+    changing any of them produces a new export instead of reusing a
+    stale one.
+    """
+    from ultralytics import YOLO, __version__
+
+    backend = backend or BACKEND
+    torch_model = None
+    weights = Path(MODEL_NAME)
+    if not weights.is_file():
+        # Resolves (and downloads) the weights the way YOLO() does
+        torch_model = YOLO(MODEL_NAME)
+        weights = Path(torch_model.ckpt_path or MODEL_NAME)
+
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                file_sha256(weights) if weights.is_file() else MODEL_NAME,
+                backend,
+                EXPORT_ARGS,
+                __version__,
+            ],
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()[:12]
+    target = MODELS_DIR / f"{weights.stem}-{backend}-{key}"
+
+    if not target.exists():
+        logger.info("Exporting %s to %s (%s)", MODEL_NAME, backend, EXPORT_ARGS)
+        torch_model = torch_model or YOLO(str(weights))
+        exported = Path(torch_model.export(format=backend, verbose=False, **EXPORT_ARGS))
+
+        staging = target.with_name(target.name + ".tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        shutil.move(str(exported), str(staging / exported.name))
+        staging.replace(target)
+        logger.info("Cached %s export in %s", backend, target)
+
+    (artifact,) = list(target.iterdir())
+    return artifact
+
+
+def load_model(backend: str = None):
+    """A fresh YOLO model running on ``backend`` (default: ``BACKEND``)."""
+    from ultralytics import YOLO
+
+    backend = backend or BACKEND
+    if backend == "torch":
+        return YOLO(MODEL_NAME)
+    return YOLO(str(exported_model(backend)), task="detect")
+
+
+def get_model():
+    """
+    The YOLO model of this process, loaded on first use.
+
+    Importing this module does not import torch or ultralytics, so code
+    that only needs the helpers below (tests, the Dagster code location)
+    does not pay for the model or trigger a weights download.
+    """
+    global _model
+    if _model is None:
+        _model = load_model()
+    return _model
+
+
+def configure_logging() -> None:
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename=LOG_DIR / "yolo_detect.log",
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+    )
+
+
 # --------------------------------------------------
 # Helpers
 # --------------------------------------------------
@@ -60,84 +183,663 @@ def classify_image(detected_classes: List[str]) -> str:
 
 
 def scan_images() -> List[Path]:
-    return list(IMAGES_DIR.rglob("*.jpg"))
+    # Sorted, so shards and the output CSV are the same on every run
+    return sorted(IMAGES_DIR.rglob("*.jpg"))
+
+
+def model_fingerprint() -> str:
+    """Identifies the results of this model and thresholds in the cache."""
+    return json.dumps(
+        {"model": MODEL_NAME, "backend": BACKEND, "classes": CLASSES, **PREDICT_ARGS},
+        sort_keys=True,
+    )
+
+
+def rows_version() -> str:
+    """Identifies the rows built from a cached result: fingerprint plus per-image limit."""
+    return json.dumps(
+        {"fingerprint": model_fingerprint(), "max_detections": MAX_DETECTIONS},
+        sort_keys=True,
+    )
+
+
+_warned_models = set()
+
+
+def predict_args(model) -> Dict:
+    """``PREDICT_ARGS`` plus the allow-list as the class ids of ``model``."""
+    if CLASSES is None:
+        return dict(PREDICT_ARGS)
+    ids = [cls_id for cls_id, name in model.names.items() if name in CLASSES]
+    if not ids and MODEL_NAME not in _warned_models:
+        # An empty list would drop every box
+        logger.warning(
+            "None of the classes %s exist in %s; not filtering classes",
+            CLASSES,
+            MODEL_NAME,
+        )
+        _warned_models.add(MODEL_NAME)
+    return dict(PREDICT_ARGS, classes=ids) if ids else dict(PREDICT_ARGS)
+
+
+def extract_detections(result) -> Tuple[List[str], List[float]]:
+    """Class names and confidences of one ultralytics ``Results``."""
+    detected = []
+    confidences = []
+
+    for box in result.boxes:
+        cls_id = int(box.cls[0])
+        detected.append(result.names[cls_id])
+        confidences.append(float(box.conf[0]))
+
+    return detected, confidences
+
+
+def top_detections(
+    detected: List[str], confidences: List[float], limit: int = None
+) -> Tuple[List[str], List[float]]:
+    """
+    The ``limit`` most confident detections of an image.
+
+    The most confident detection of every person / product class is kept
+    on top of that, so the image category that fct_image_detections
+    derives from the rows matches the one computed here.
+    """
+    if limit is None or len(detected) <= limit:
+        return detected, confidences
+
+    order = sorted(range(len(detected)), key=lambda i: -confidences[i])
+    keep = set(order[:limit])
+    seen = set()
+    for i in order:
+        cls = detected[i]
+        if cls in PERSON_CLASSES | PRODUCT_CLASSES and cls not in seen:
+            seen.add(cls)
+            keep.add(i)
+
+    kept = sorted(keep, key=lambda i: -confidences[i])
+    return [detected[i] for i in kept], [confidences[i] for i in kept]
+
+
+def image_key(image_path: Path) -> Tuple[str, str, str]:
+    """(message_id, channel_name, model_version) of an image's detection rows."""
+    return image_path.stem, image_path.parent.name, MODEL_NAME
+
+
+def detection_rows(image_path: Path, detected: List[str], confidences: List[float]):
+    # Category from every detection, before the per-image limit
+    image_category = classify_image(detected)
+    detected, confidences = top_detections(detected, confidences, MAX_DETECTIONS)
+
+    message_id, channel_name, _ = image_key(image_path)
+
+    return [
+        {
+            "message_id": message_id,
+            "channel_name": channel_name,
+            "detected_class": cls,
+            "confidence_score": round(conf, 4),
+            "image_category": image_category,
+            "model_version": MODEL_NAME,
+        }
+        for cls, conf in zip(detected, confidences)
+    ]
+
+
+def decode_image(image_path: Path) -> np.ndarray:
+    """BGR pixels of an image file, read the way ultralytics reads paths."""
+    import cv2
+
+    frame = cv2.imdecode(np.fromfile(str(image_path), np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("cannot decode image")
+    return frame
+
+
+def _decode_timed(image_path: Path):
+    start = time.perf_counter()
+    try:
+        frame, error = decode_image(image_path), None
+    except Exception as exc:
+        frame, error = None, exc
+    return frame, error, time.perf_counter() - start
+
+
+def prefetch_batches(
+    batches: Iterable[List[Path]],
+    timings: Dict[str, float],
+    workers: int = None,
+    depth: int = None,
+) -> Iterator[Tuple[List[Path], List[np.ndarray]]]:
+    """
+    Yield ``(paths, frames)`` per batch, decoded on a thread pool.
+
+    While the caller runs inference on one batch, the next ``depth``
+    batches are already being read and decoded (OpenCV releases the GIL),
+    so at most ``depth + 1`` batches of frames are held in memory.
+    Images that fail to decode are logged and left out of their batch.
+    Decode time (summed over threads) and the time spent waiting for it
+    are added to ``timings``.
+    """
+    workers = max(1, int(workers or DECODE_WORKERS))
+    depth = max(0, int(PREFETCH_BATCHES if depth is None else depth))
+    batches = iter(batches)
+    window = deque()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="yolo-decode")
+
+    def submit_next():
+        batch = next(batches, None)
+        if batch is not None:
+            window.append((batch, [pool.submit(_decode_timed, p) for p in batch]))
+
+    try:
+        for _ in range(depth + 1):
+            submit_next()
+
+        while window:
+            batch, futures = window.popleft()
+            submit_next()
+
+            start = time.perf_counter()
+            decoded = [f.result() for f in futures]
+            timings["wait"] = timings.get("wait", 0.0) + time.perf_counter() - start
+
+            paths, frames = [], []
+            for image_path, (frame, error, elapsed) in zip(batch, decoded):
+                timings["decode"] = timings.get("decode", 0.0) + elapsed
+                if error is not None:
+                    logger.warning("Failed processing %s: %s", image_path, error)
+                    continue
+                paths.append(image_path)
+                frames.append(frame)
+            yield paths, frames
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def infer_batch(
+    images: List[Path], frames: List[np.ndarray]
+) -> Dict[Path, Tuple[List[str], List[float]]]:
+    """
+    Run the model on a batch of decoded images in one call.
+
+    If the batch fails, the images are retried one by one so only the
+    bad one is dropped.
+    """
+    try:
+        model = get_model()
+        results = model(
+            frames,
+            batch=len(frames),
+            verbose=False,
+            **predict_args(model),
+        )
+        return {p: extract_detections(r) for p, r in zip(images, results)}
+    except Exception as exc:
+        if len(images) == 1:
+            logger.warning("Failed processing %s: %s", images[0], exc)
+            return {}
+        logger.warning(
+            "Batch of %d images failed (%s); retrying one by one", len(images), exc
+        )
+        detections = {}
+        for image_path, frame in zip(images, frames):
+            detections.update(infer_batch([image_path], [frame]))
+        return detections
+
+
+def infer_images(
+    images: List[Path], batch_size: int, timings: Dict[str, float]
+) -> Iterator[Dict[Path, Tuple[List[str], List[float]]]]:
+    """Yield the detections of ``images``, one batch at a time."""
+    batches = (
+        images[start:start + batch_size]
+        for start in range(0, len(images), batch_size)
+    )
+    for paths, frames in prefetch_batches(batches, timings):
+        if not paths:
+            continue
+        start = time.perf_counter()
+        inferred = infer_batch(paths, frames)
+        timings["inference"] = (
+            timings.get("inference", 0.0) + time.perf_counter() - start
+        )
+        yield inferred
 
 
 # --------------------------------------------------
-# Core enrichment
+# Sharded inference
 # --------------------------------------------------
 
-def run_yolo_enrichment():
-    logger.info("Starting YOLO image enrichment")
 
-    rows: List[Dict] = []
+def _init_worker(threads: int, thresholds: Dict, classes: List[str]) -> None:
+    global CLASSES
+    import torch
+
+    # N processes each running torch's default of one thread per core
+    # oversubscribe the host; pin every worker to its share instead
+    torch.set_num_threads(threads)
+    PREDICT_ARGS.update(thresholds)
+    CLASSES = classes
+    configure_logging()
+
+
+def _infer_shard(
+    index: int, images: List[Path], batch_size: int
+) -> Tuple[int, Path, Dict[str, float]]:
+    timings: Dict[str, float] = {}
+    detections = {}
+    for inferred in infer_images(images, batch_size, timings):
+        detections.update(inferred)
+
+    part = SHARD_DIR / f"shard-{index:03d}.json"
+    part.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = part.with_suffix(".tmp")
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump({str(p): list(d) for p, d in detections.items()}, f)
+    temp_file.replace(part)
+    return index, part, timings
+
+
+def infer_sharded(
+    images: List[Path],
+    workers: int,
+    batch_size: int,
+    timings: Dict[str, float],
+    threads: int = None,
+) -> Iterator[Dict[Path, Tuple[List[str], List[float]]]]:
+    """
+    Split ``images`` round-robin into ``workers`` shards, one process each.
+
+    Every worker loads its own model with ``threads`` torch threads and
+    writes its detections to a partial file under ``SHARD_DIR``. The
+    partials are yielded in shard order once all workers are done, so the
+    merge does not depend on which worker finished first. When a worker
+    fails, the other shards are still yielded (and cached by the caller)
+    before the error is raised.
+    """
+    if BACKEND != "torch":
+        # Export once here rather than racing to do it in every worker
+        exported_model()
+
+    workers = max(1, min(workers, len(images)))
+    threads = max(1, int(threads or (os.cpu_count() or 1) // workers))
+    shards = [images[i::workers] for i in range(workers)]
+    logger.info(
+        "Sharding %d images over %d workers (%d torch threads each)",
+        len(images),
+        workers,
+        threads,
+    )
+
+    parts: Dict[int, Path] = {}
+    errors: List[str] = []
+    # spawn: torch does not survive a fork once its thread pools started
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads, dict(PREDICT_ARGS), CLASSES),
+    )
+    try:
+        futures = {
+            executor.submit(_infer_shard, i, shard, batch_size): i
+            for i, shard in enumerate(shards)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                index, part, shard_timings = future.result()
+            except Exception as exc:
+                errors.append(f"shard {futures[future]}: {exc}")
+                logger.error("Shard %d failed: %s", futures[future], exc)
+                continue
+            parts[index] = part
+            for stage, seconds in shard_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            logger.info(
+                "[%d/%d] shard %d done (%d images)",
+                done,
+                workers,
+                index,
+                len(shards[index]),
+            )
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+    yield from merge_shards(parts, errors)
+
+
+def merge_shards(
+    parts: Dict[int, Path], errors: List[str]
+) -> Iterator[Dict[Path, Tuple[List[str], List[float]]]]:
+    """
+    Yield the partial files of ``infer_sharded`` in shard order, then
+    raise for the shards listed in ``errors``.
+
+    Every partial file is removed, including the ones not yet read when
+    the consumer stops early.
+    """
+    try:
+        for index in sorted(parts):
+            with open(parts[index], "r", encoding="utf-8") as f:
+                partial = json.load(f)
+            yield {Path(p): (d[0], d[1]) for p, d in partial.items()}
+    finally:
+        for part in parts.values():
+            part.unlink(missing_ok=True)
+
+    if errors:
+        raise RuntimeError(f"YOLO inference failed in {'; '.join(errors)}")
 
-    images = scan_images()
-    logger.info("Found %d images", len(images))
 
-    for image_path in images:
-        try:
-            results = model(image_path, verbose=False)[0]
+# --------------------------------------------------
+# Backend parity
+# --------------------------------------------------
 
-            detected = []
-            confidences = []
 
-            for box in results.boxes:
-                cls_id = int(box.cls[0])
-                cls_name = model.names[cls_id]
-                conf = float(box.conf[0])
+def compare_detections(
+    reference: Tuple[List[str], List[float]],
+    candidate: Tuple[List[str], List[float]],
+    tolerance: float = 0.01,
+) -> List[str]:
+    """Differences between two ``extract_detections`` results of one image."""
+    ref = sorted(zip(*reference))
+    cand = sorted(zip(*candidate))
+    if [cls for cls, _ in ref] != [cls for cls, _ in cand]:
+        return [f"classes {[c for c, _ in ref]} != {[c for c, _ in cand]}"]
+    return [
+        f"{cls} confidence {a:.4f} != {b:.4f}"
+        for (cls, a), (_, b) in zip(ref, cand)
+        if abs(a - b) > tolerance
+    ]
+
+
+def check_parity(
+    images: List[Path], backend: str = None, tolerance: float = 0.01
+) -> List[str]:
+    """
+    Run ``images`` through the torch weights and through ``backend``.
+
+    Returns one line per difference: class names of the two models, or
+    the classes / confidences detected on an image. Empty means the
+    backend is a drop-in replacement at this ``tolerance``.
+    """
+    reference = load_model("torch")
+    candidate = load_model(backend)
+    if dict(candidate.names) != dict(reference.names):
+        return ["class names differ between the torch and exported model"]
+
+    problems = []
+    for image_path in images:
+        try:
+            frame = decode_image(image_path)
+        except Exception as exc:
+            logger.warning("Failed processing %s: %s", image_path, exc)
+            continue
+        expected = extract_detections(
+            reference(frame, verbose=False, **predict_args(reference))[0]
+        )
+        actual = extract_detections(
+            candidate(frame, verbose=False, **predict_args(candidate))[0]
+        )
+        problems.extend(
+            f"{image_path}: {diff}"
+            for diff in compare_detections(expected, actual, tolerance)
+        )
+    return problems
 
-                detected.append(cls_name)
-                confidences.append(conf)
 
-            image_category = classify_image(detected)
+# --------------------------------------------------
+# Core enrichment
+# --------------------------------------------------
 
-            message_id = image_path.stem
-            channel_name = image_path.parent.name
+def write_detections(
+    sinks: List[DetectionSink],
+    batches: Iterable[Dict[Path, Tuple[List[str], List[float]]]],
+    paths_of: Dict[Path, List[Path]],
+    changed: Set[Path],
+) -> int:
+    """
+    Stream detection rows into every sink as ``batches`` arrive, then commit.
+
+    ``batches`` yields ``{image: (classes, confidences)}`` dicts, so rows
+    reach the sinks while inference is still running. Full sinks get
+    every path of every image; incremental ones only the paths in
+    ``changed``, which may grow while the batches are produced. Each
+    sink is handed about ``SINK_BATCH_ROWS`` rows at a time, so the full
+    row set never sits in memory. If any sink fails, all of them are
+    aborted. Returns the number of rows generated.
+    """
+    written = 0
+    buffers = [([], []) for _ in sinks]
+
+    def flush(index: int) -> None:
+        rows, keys = buffers[index]
+        sinks[index].write(rows, keys)
+        buffers[index] = ([], [])
+
+    try:
+        for sink in sinks:
+            sink.open()
+
+        for batch in batches:
+            for image_path, (detected, confidences) in batch.items():
+                for path in paths_of[image_path]:
+                    targets = [
+                        i for i, sink in enumerate(sinks)
+                        if not sink.incremental or path in changed
+                    ]
+                    if not targets:
+                        continue
+                    rows = detection_rows(path, detected, confidences)
+                    written += len(rows)
+                    for i in targets:
+                        buffers[i][0].extend(rows)
+                        buffers[i][1].append(image_key(path))
+                        if max(map(len, buffers[i])) >= SINK_BATCH_ROWS:
+                            flush(i)
+
+        for i, (_, keys) in enumerate(buffers):
+            if keys:
+                flush(i)
+        for sink in sinks:
+            sink.commit()
+    except BaseException:
+        for sink in sinks:
+            sink.abort()
+        raise
+    return written
+
+
+def run_yolo_enrichment(
+    batch_size: int = None,
+    force: bool = False,
+    workers: int = None,
+    sinks: List[str] = None,
+    full_refresh: bool = False,
+):
+    """
+    Detect objects in every scraped image and write the detections out.
+
+    Only images the detection cache has no result for (new or changed
+    files, or a different model / thresholds) are run through YOLO;
+    ``force`` re-infers everything. Rows are streamed to ``sinks``
+    (default ``yolo.sinks``) as inference batches complete. The CSV
+    always covers every image; Postgres only receives the images whose
+    rows it lacks or that changed (inferred in this run, or a different
+    ``max_detections``), unless ``full_refresh`` replaces the table
+    contents with all of them. With ``workers`` > 1 inference is
+    sharded over that many processes.
+    """
+    batch_size = max(1, int(batch_size or BATCH_SIZE))
+    workers = max(1, int(workers or WORKERS))
+    # Fail on a bad sink name before spending time on inference
+    outputs = [
+        make_sink(name, OUTPUT_CSV, full_refresh=full_refresh)
+        for name in (sinks or SINK_NAMES)
+    ]
+    logger.info(
+        "Starting YOLO image enrichment (batch size %d, sinks: %s)",
+        batch_size,
+        ", ".join(sink.name for sink in outputs),
+    )
 
-            for cls, conf in zip(detected, confidences):
-                rows.append(
-                    {
-                        "message_id": message_id,
-                        "channel_name": channel_name,
-                        "detected_class": cls,
-                        "confidence_score": round(conf, 4),
-                        "image_category": image_category,
-                    }
-                )
+    images = scan_images()
+    logger.info("Found %d images", len(images))
 
-        except Exception as exc:
+    # Duplicate images are hard-linked by the scraper's image store and
+    # share an inode: run inference once and reuse it for every path.
+    by_inode: Dict[tuple, List[Path]] = {}
+    for image_path in images:
+        try:
+            stat = image_path.stat()
+        except OSError as exc:
             logger.warning("Failed processing %s: %s", image_path, exc)
+            continue
+        by_inode.setdefault((stat.st_dev, stat.st_ino), []).append(image_path)
 
-    write_csv(rows)
-    logger.info("YOLO enrichment completed | rows: %d", len(rows))
+    unique = [paths[0] for paths in by_inode.values()]
+    paths_of = {paths[0]: paths for paths in by_inode.values()}
 
+    cache = DetectionCache(CACHE_PATH, IMAGES_DIR, model_fingerprint())
+    version = rows_version()
+    cached: Dict[Path, Tuple[List[str], List[float]]] = {}
+    pending: List[Path] = []
+    # Paths whose rows Postgres does not have under the current version
+    changed: Set[Path] = set()
 
-def write_csv(rows: List[Dict]):
-    if not rows:
-        logger.warning("No detection results to write")
-        return
-
-    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "message_id",
-                "channel_name",
-                "detected_class",
-                "confidence_score",
-                "image_category",
-            ],
+    for image_path in unique:
+        try:
+            hit = None if force else cache.get(image_path)
+            if hit is not None:
+                changed.update(
+                    p for p in paths_of[image_path]
+                    if not cache.is_published(p, version)
+                )
+        except OSError as exc:
+            logger.warning("Failed processing %s: %s", image_path, exc)
+            continue
+        if hit is None:
+            pending.append(image_path)
+        else:
+            cached[image_path] = hit
+
+    logger.info(
+        "Detection cache: %d images cached (%d paths to republish), %d to infer",
+        len(cached),
+        len(changed),
+        len(pending),
+    )
+
+    timings = {"decode": 0.0, "wait": 0.0, "inference": 0.0}
+    if workers > 1 and len(pending) > 1:
+        results = infer_sharded(
+            pending, workers, batch_size, timings, THREADS_PER_WORKER
         )
-        writer.writeheader()
-        writer.writerows(rows)
+    else:
+        results = infer_images(pending, batch_size, timings)
+
+    def batches():
+        yield cached
+        for inferred in results:
+            for image_path, (detected, confidences) in inferred.items():
+                cache.put(image_path, detected, confidences)
+                changed.update(paths_of[image_path])
+            yield inferred
+
+    try:
+        rows = write_detections(outputs, batches(), paths_of, changed)
+        if any(sink.name == "postgres" for sink in outputs):
+            cache.mark_published(
+                (p for paths in paths_of.values() for p in paths)
+                if full_refresh
+                else changed,
+                version,
+            )
+    finally:
+        # Keep whatever was inferred, even if the run is interrupted
+        cache.prune(p for paths in paths_of.values() for p in paths)
+        cache.save()
+
+    logger.info(
+        "Stage timings (summed over workers) | decode: %.2fs (%d threads) "
+        "| waiting on decode: %.2fs | inference: %.2fs",
+        timings["decode"],
+        DECODE_WORKERS,
+        timings["wait"],
+        timings["inference"],
+    )
 
-    logger.info("Saved YOLO results to %s", OUTPUT_CSV)
+    if not rows:
+        logger.warning("No detection results to write")
+    logger.info(
+        "YOLO enrichment completed | rows: %d | unique images: %d | inferred: %d",
+        rows,
+        len(unique),
+        len(pending),
+    )
 
 
 # --------------------------------------------------
 # Entrypoint
 # --------------------------------------------------
 
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="YOLO image enrichment")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-run YOLO on every image, ignoring the detection cache",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Inference processes (default: yolo.workers)",
+    )
+    parser.add_argument(
+        "--sink",
+        action="append",
+        choices=["postgres", "csv"],
+        help="Output destination, repeatable (default: yolo.sinks)",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Replace every detection in Postgres instead of only new or changed images",
+    )
+    parser.add_argument(
+        "--parity-check",
+        type=int,
+        metavar="N",
+        help=(
+            "Compare yolo.backend against the torch weights on N sample "
+            "images instead of running the enrichment"
+        ),
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if args.parity_check:
+        images = scan_images()
+        sample = images[:: max(1, len(images) // args.parity_check)][: args.parity_check]
+        problems = check_parity(sample)
+        for problem in problems:
+            logger.warning("Parity: %s", problem)
+        print(
+            f"{BACKEND} vs torch on {len(sample)} images: "
+            f"{len(problems) or 'no'} differences"
+        )
+        sys.exit(1 if problems else 0)
+
+    run_yolo_enrichment(
+        force=args.force,
+        workers=args.workers,
+        sinks=args.sink,
+        full_refresh=args.full_refresh,
+    )
+
+
 if __name__ == "__main__":
-    run_yolo_enrichment()
+    main()
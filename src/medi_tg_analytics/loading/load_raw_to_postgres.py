@@ -1,69 +1,90 @@
-import os
-import json
+import io
+import time
 import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from itertools import islice
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-import psycopg2
 from psycopg2.extras import execute_values
-from dotenv import load_dotenv
 
 from medi_tg_analytics.core.settings import settings
+from medi_tg_analytics.db.pool import connection
+from medi_tg_analytics.loading.manifest import LoadManifest
+from medi_tg_analytics.loading.partitions import MessagePartitions, setup_table
+from medi_tg_analytics.scraping.formats import is_raw_file, read_records
 
 # ------------------------------------------------------------------
 # Setup
 # ------------------------------------------------------------------
 
-load_dotenv()
-
 RAW_DIR: Path = settings.paths.DATA["raw_dir"] / "telegram_messages"
 FLAG_FILE: Path = settings.paths.DATA["interim_dir"] / "raw_loaded.flag"
+LOADING_CFG = settings.get("loading", {})
+BATCH_SIZE = 5000
+COMMIT_MODES = ("batch", "file", "run")
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s | %(levelname)s | %(message)s",
 )
 
-# ------------------------------------------------------------------
-# Database connection
-# ------------------------------------------------------------------
-
-
-def get_connection():
-    try:
-        return psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-        )
-    except psycopg2.Error as e:
-        raise RuntimeError(f"Failed to connect to PostgreSQL: {e}")
-
-
 # ------------------------------------------------------------------
 # Schema & table setup
 # ------------------------------------------------------------------
 
 CREATE_SCHEMA_SQL = "CREATE SCHEMA IF NOT EXISTS raw;"
 
-CREATE_TABLE_SQL = """
-CREATE TABLE IF NOT EXISTS raw.telegram_messages (
-    message_id     BIGINT PRIMARY KEY,
-    channel_name   TEXT NOT NULL,
+# ignore: keep the first scrape of a message
+# update: refresh view/forward counts, but only when they grew, so
+#   unchanged rows are not rewritten and an older file never rolls back
+#   newer counts; updated_at marks the rows incremental models must pick up
+ON_CONFLICT_SQL = {
+    "ignore": "ON CONFLICT (channel_name, message_id, message_date) DO NOTHING",
+    "update": """ON CONFLICT (channel_name, message_id, message_date) DO UPDATE SET
+    view_count = GREATEST(t.view_count, EXCLUDED.view_count),
+    forward_count = GREATEST(t.forward_count, EXCLUDED.forward_count),
+    updated_at = now()
+WHERE (
+    GREATEST(t.view_count, EXCLUDED.view_count),
+    GREATEST(t.forward_count, EXCLUDED.forward_count)
+) IS DISTINCT FROM (t.view_count, t.forward_count)""",
+}
+
+INSERT_SQL = """
+INSERT INTO raw.telegram_messages AS t (
+    message_id,
+    channel_name,
+    message_date,
+    message_text,
+    view_count,
+    forward_count,
+    has_media,
+    image_path
+)
+VALUES %s
+{on_conflict};
+"""
+
+# Session-local staging table for the COPY path; dropped with the connection
+CREATE_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS _stage_telegram_messages (
+    message_id     BIGINT,
+    channel_name   TEXT,
     message_date   TIMESTAMP,
     message_text   TEXT,
     view_count     INT,
     forward_count  INT,
     has_media      BOOLEAN,
-    image_path     TEXT,
-    ingested_at    TIMESTAMP DEFAULT now()
+    image_path     TEXT
 );
 """
 
-INSERT_SQL = """
-INSERT INTO raw.telegram_messages (
+COPY_STAGE_SQL = """
+COPY _stage_telegram_messages (
     message_id,
     channel_name,
     message_date,
@@ -73,10 +94,35 @@ INSERT INTO raw.telegram_messages (
     has_media,
     image_path
 )
-VALUES %s
-ON CONFLICT (message_id) DO NOTHING;
+FROM STDIN;
 """
 
+MERGE_STAGE_SQL = """
+INSERT INTO raw.telegram_messages AS t (
+    message_id,
+    channel_name,
+    message_date,
+    message_text,
+    view_count,
+    forward_count,
+    has_media,
+    image_path
+)
+SELECT
+    message_id,
+    channel_name,
+    message_date,
+    message_text,
+    view_count,
+    forward_count,
+    has_media,
+    image_path
+FROM _stage_telegram_messages
+{on_conflict};
+"""
+
+TRUNCATE_STAGE_SQL = "TRUNCATE _stage_telegram_messages;"
+
 
 # ------------------------------------------------------------------
 # Loader logic
@@ -87,65 +133,362 @@ def validate_raw_dir():
         raise FileNotFoundError(f"Raw data directory not found: {RAW_DIR}")
 
 
-def parse_messages(json_path: Path) -> List[Tuple]:
-    with open(json_path, "r", encoding="utf-8") as f:
-        messages = json.load(f)
-
-    rows = []
-    for m in messages:
-        rows.append(
-            (
-                m.get("message_id"),
-                m.get("channel_name"),
-                m.get("message_date"),
-                m.get("message_text"),
-                m.get("views", 0),
-                m.get("forwards", 0),
-                m.get("has_media", False),
-                m.get("image_path"),
-            )
+def utc_timestamp(value) -> Optional[datetime]:
+    """
+    ``message_date`` as a naive UTC datetime for the TIMESTAMP column.
+
+    Parquet yields tz-aware datetimes, which insert mode would send as
+    timestamptz (shifted to the session time zone), while COPY and ISO
+    strings would drop the offset; normalising here gives every format
+    the same key and partition month.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def iter_rows(raw_path: Path) -> Iterator[Tuple]:
+    """Stream insert-ready rows from a (compressed) JSON, NDJSON or Parquet file."""
+    for m in read_records(raw_path):
+        yield (
+            m.get("message_id"),
+            m.get("channel_name"),
+            utc_timestamp(m.get("message_date")),
+            m.get("message_text"),
+            m.get("views", 0),
+            m.get("forwards", 0),
+            m.get("has_media", False),
+            m.get("image_path"),
         )
 
-    return rows
 
+def parse_messages(json_path: Path) -> List[Tuple]:
+    return list(iter_rows(json_path))
+
+
+def list_raw_files(date_dir: Path) -> List[Path]:
+    return sorted(p for p in date_dir.iterdir() if is_raw_file(p))
+
+
+def batched(rows: Iterable[Tuple], size: int) -> Iterator[List[Tuple]]:
+    it = iter(rows)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _copy_value(value) -> str:
+    """Encode one value for COPY's text format (``\\N`` is NULL)."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
 
-def load_json_to_raw():
-    validate_raw_dir()
 
-    conn = get_connection()
-    cur = conn.cursor()
+def copy_payload(rows: Iterable[Tuple]) -> str:
+    """Render rows as a COPY ... FROM STDIN text-format payload."""
+    return "".join(
+        "\t".join(_copy_value(v) for v in row) + "\n" for row in rows
+    )
+
+
+def dedupe_rows(batch: List[Tuple]) -> List[Tuple]:
+    """
+    One row per (channel_name, message_id), keeping the highest counts.
+
+    ``ON CONFLICT DO UPDATE`` refuses to touch the same row twice in one
+    statement, so duplicates inside a batch must be collapsed first.
+    """
+    latest: Dict = {}
+    for row in batch:
+        key = (row[1], row[0])
+        seen = latest.get(key)
+        if seen is None or (row[4] or 0, row[5] or 0) > (seen[4] or 0, seen[5] or 0):
+            latest[key] = row
+    return list(latest.values())
+
+
+def insert_batch(cur, batch: List[Tuple], on_conflict: str = "ignore") -> None:
+    # One multi-row INSERT per batch instead of execute_values' 100-row pages
+    sql = INSERT_SQL.format(on_conflict=ON_CONFLICT_SQL[on_conflict])
+    execute_values(cur, sql, batch, page_size=len(batch))
+
+
+def copy_batch(cur, batch: List[Tuple], on_conflict: str = "ignore") -> None:
+    """COPY a batch into the staging table and merge it in one statement."""
+    cur.copy_expert(COPY_STAGE_SQL, io.StringIO(copy_payload(batch)))
+    cur.execute(MERGE_STAGE_SQL.format(on_conflict=ON_CONFLICT_SQL[on_conflict]))
+    cur.execute(TRUNCATE_STAGE_SQL)
 
-    # Ensure schema and table exist
-    cur.execute(CREATE_SCHEMA_SQL)
-    cur.execute(CREATE_TABLE_SQL)
-    conn.commit()
 
-    total_inserted = 0
-    total_files = 0
+LOAD_MODES = {
+    "insert": insert_batch,
+    "copy": copy_batch,
+}
 
+
+def pending_files(manifest: Optional[LoadManifest], force: bool = False):
+    """Raw files to load, oldest partition first, and the unchanged count."""
+    files = []
+    skipped = 0
     for date_dir in sorted(RAW_DIR.iterdir()):
         if not date_dir.is_dir():
             continue
+        for raw_file in list_raw_files(date_dir):
+            if not force and manifest is not None and manifest.is_current(raw_file):
+                skipped += 1
+                continue
+            files.append(raw_file)
+    return files, skipped
+
+
+def load_file(
+    conn,
+    raw_file: Path,
+    load_batch,
+    partitions: MessagePartitions,
+    manifest: LoadManifest,
+    batch_size: int = BATCH_SIZE,
+    on_conflict: str = "ignore",
+    commit: str = "file",
+) -> Tuple[int, int]:
+    """Stream one raw file into the table; return (loaded, undated) rows."""
+    cur = conn.cursor()
+    loaded = 0
+    undated = 0
+    # Stream the file in batches so memory stays flat
+    for batch in batched(iter_rows(raw_file), batch_size):
+        # message_date is the partition key; such rows cannot be routed
+        dated = [row for row in batch if row[2] is not None]
+        undated += len(batch) - len(dated)
+        if not dated:
+            continue
+        batch = dated
+        if on_conflict == "update":
+            batch = dedupe_rows(batch)
+        months = partitions.missing(batch)
+        if months:
+            # Partition DDL must not sit in a transaction that holds rows:
+            # its lock would stall every other loader until that commits.
+            # The file is not in the manifest yet, so should the run fail
+            # from here on it is loaded again, which on_conflict absorbs.
+            conn.commit()
+            partitions.create(cur, months)
+            conn.commit()
+        load_batch(cur, batch, on_conflict)
+        loaded += len(batch)
+        if commit == "batch":
+            conn.commit()
+    manifest.record(cur, raw_file, loaded)
+    if commit != "run":
+        conn.commit()
+    cur.close()
+    return loaded, undated
 
-        for json_file in sorted(date_dir.glob("*.json")):
-            rows = parse_messages(json_file)
 
-            if not rows:
-                logging.warning(f"No records in {json_file}")
-                continue
+def log_file_result(raw_file: Path, loaded: int, undated: int, prefix: str = "") -> None:
+    if undated:
+        logging.warning(
+            f"Skipped {undated} messages without message_date in {raw_file}"
+        )
+    if not loaded:
+        logging.warning(f"No records in {raw_file}")
+        return
+    logging.info(
+        f"{prefix}Loaded {loaded} messages from {raw_file.relative_to(RAW_DIR)}"
+    )
 
-            execute_values(cur, INSERT_SQL, rows)
-            conn.commit()
 
-            total_inserted += len(rows)
-            total_files += 1
+# ------------------------------------------------------------------
+# Parallel loading
+# ------------------------------------------------------------------
+
+# Per-process loader state: the worker's pooled connection is reused for
+# every file it handles, next to its own partition and manifest caches
+_worker: Dict = {}
+
+
+def _init_worker(raw_dir: Path, mode: str, options: Dict, hash_partitions: int) -> None:
+    global RAW_DIR
+    RAW_DIR = raw_dir
+    with connection("bulk") as conn:
+        cur = conn.cursor()
+        partitions = MessagePartitions(hash_partitions).load(cur)
+        cur.close()
+    _worker.update(
+        mode=mode,
+        partitions=partitions,
+        manifest=LoadManifest(raw_dir),
+        options=options,
+    )
+
 
+def _load_in_worker(raw_file: Path) -> Tuple[Path, int, int, float]:
+    start = time.perf_counter()
+    with connection("bulk") as conn:
+        if _worker["mode"] == "copy":
+            with conn.cursor() as cur:
+                cur.execute(CREATE_STAGE_SQL)
+        loaded, undated = load_file(
+            conn,
+            raw_file,
+            LOAD_MODES[_worker["mode"]],
+            _worker["partitions"],
+            _worker["manifest"],
+            **_worker["options"],
+        )
+    return raw_file, loaded, undated, time.perf_counter() - start
+
+
+def load_files_parallel(
+    files: List[Path],
+    workers: int,
+    mode: str,
+    options: Dict,
+    hash_partitions: int = 0,
+) -> int:
+    """
+    Fan files out over ``workers`` processes, one connection each.
+
+    Every file is committed on its own, together with its manifest entry,
+    so when a worker fails the remaining files are cancelled and a rerun
+    picks up exactly the files that did not make it.
+    """
+    total_loaded = 0
+    start = time.perf_counter()
+    # spawn: a forked child would inherit (and on exit close) the sockets
+    # of the parent's pooled connections
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(RAW_DIR, mode, options, hash_partitions),
+    )
+    try:
+        futures = {executor.submit(_load_in_worker, f): f for f in files}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                raw_file, loaded, undated, seconds = future.result()
+            except Exception as exc:
+                raise RuntimeError(
+                    f"Failed to load {futures[future]}: {exc}"
+                ) from exc
+            total_loaded += loaded
+            elapsed = time.perf_counter() - start
+            log_file_result(
+                raw_file, loaded, undated, prefix=f"[{done}/{len(files)}] "
+            )
             logging.info(
-                f"Loaded {len(rows)} messages from {json_file.relative_to(RAW_DIR)}"
+                f"[{done}/{len(files)}] {seconds:.1f}s for this file; "
+                f"{total_loaded} messages in {elapsed:.1f}s "
+                f"({total_loaded / elapsed if elapsed else 0:.0f} msg/s overall)"
             )
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+    return total_loaded
+
+
+def load_json_to_raw(
+    mode: str = None,
+    batch_size: int = None,
+    commit: str = None,
+    force: bool = False,
+    on_conflict: str = None,
+    workers: int = None,
+):
+    """
+    Load new or changed raw landing files into ``raw.telegram_messages``.
+
+    Files recorded in ``raw._load_manifest`` with the same content are
+    skipped without being opened; ``force`` loads every file again.
+
+    - ``mode``: ``insert`` (execute_values) or ``copy`` (COPY into a temp
+      staging table, then one set-based merge per batch)
+    - ``batch_size``: rows per insert / COPY round trip
+    - ``commit``: commit after every ``batch``, every ``file`` or once per
+      ``run`` (``run`` acts as ``file`` with several workers)
+    - ``on_conflict``: ``ignore`` known messages or ``update`` their
+      view/forward counts when they changed
+    - ``workers``: files loaded in parallel, one process and connection
+      each; 1 loads sequentially on a single connection
+
+    Unset arguments fall back to the ``loading`` section of
+    config/database.yaml.
+    """
+    mode = mode or LOADING_CFG.get("mode", "insert")
+    batch_size = int(batch_size or LOADING_CFG.get("batch_size", BATCH_SIZE))
+    commit = commit or LOADING_CFG.get("commit", "file")
+    on_conflict = on_conflict or LOADING_CFG.get("on_conflict", "ignore")
+    workers = max(1, int(workers or LOADING_CFG.get("workers", 1)))
+    hash_partitions = LOADING_CFG.get("partitioning", {}).get("hash_partitions", 0)
+    if mode not in LOAD_MODES:
+        raise ValueError(
+            f"Unknown load mode {mode!r}; expected one of {sorted(LOAD_MODES)}"
+        )
+    if commit not in COMMIT_MODES:
+        raise ValueError(
+            f"Unknown commit mode {commit!r}; expected one of {list(COMMIT_MODES)}"
+        )
+    if on_conflict not in ON_CONFLICT_SQL:
+        raise ValueError(
+            f"Unknown on_conflict {on_conflict!r}; "
+            f"expected one of {sorted(ON_CONFLICT_SQL)}"
+        )
+    if workers > 1 and commit == "run":
+        commit = "file"
 
-    cur.close()
-    conn.close()
+    validate_raw_dir()
+
+    with connection("bulk") as conn:
+        cur = conn.cursor()
+
+        # Ensure schema and table exist
+        cur.execute(CREATE_SCHEMA_SQL)
+        partitions = MessagePartitions(hash_partitions)
+        setup_table(cur, partitions)
+        if mode == "copy" and workers == 1:
+            cur.execute(CREATE_STAGE_SQL)
+        manifest = LoadManifest(RAW_DIR).load(cur)
+        conn.commit()
+
+        files, skipped_files = pending_files(manifest, force)
+        logging.info(
+            f"Loading {len(files)} files in {mode} mode: batch_size={batch_size}, "
+            f"commit={commit}, on_conflict={on_conflict}, workers={workers}"
+        )
+        options = dict(batch_size=batch_size, on_conflict=on_conflict, commit=commit)
+
+        total_inserted = 0
+        if workers > 1 and len(files) > 1:
+            total_inserted = load_files_parallel(
+                files, min(workers, len(files)), mode, options, hash_partitions
+            )
+        else:
+            for raw_file in files:
+                loaded, undated = load_file(
+                    conn, raw_file, LOAD_MODES[mode], partitions, manifest, **options
+                )
+                total_inserted += loaded
+                log_file_result(raw_file, loaded, undated)
+
+        manifest.record_touched(cur)
+        conn.commit()
+        cur.close()
 
     # DVC marker file
     FLAG_FILE.parent.mkdir(parents=True, exist_ok=True)
@@ -153,7 +496,8 @@ def load_json_to_raw():
         f.write("raw telegram messages loaded")
 
     logging.info(
-        f"Completed loading: {total_inserted} messages from {total_files} files"
+        f"Completed loading: {total_inserted} messages from {len(files)} files "
+        f"({skipped_files} unchanged files skipped)"
     )
     logging.info(f"DVC flag written to {FLAG_FILE}")
 
@@ -163,5 +507,28 @@ def load_json_to_raw():
 # ------------------------------------------------------------------
 
 if __name__ == "__main__":
-    load_json_to_raw()
+    parser = argparse.ArgumentParser(description="Load raw Telegram messages")
+    parser.add_argument("--mode", choices=sorted(LOAD_MODES), default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--commit", choices=COMMIT_MODES, default=None)
+    parser.add_argument(
+        "--on-conflict", choices=sorted(ON_CONFLICT_SQL), default=None
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Files loaded in parallel"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Ignore the load manifest and reload every raw file",
+    )
+    args = parser.parse_args()
+    load_json_to_raw(
+        mode=args.mode,
+        batch_size=args.batch_size,
+        commit=args.commit,
+        force=args.force,
+        on_conflict=args.on_conflict,
+        workers=args.workers,
+    )
     print("✅ Raw Telegram data successfully loaded into PostgreSQL")
@@ -0,0 +1,119 @@
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from medi_tg_analytics.utils.files import file_sha256
+
+logger = logging.getLogger(__name__)
+
+CREATE_MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS raw._load_manifest (
+    file_path      TEXT PRIMARY KEY,
+    file_size      BIGINT NOT NULL,
+    file_mtime_ns  BIGINT NOT NULL,
+    content_hash   TEXT NOT NULL,
+    row_count      INT,
+    loaded_at      TIMESTAMP DEFAULT now()
+);
+"""
+
+SELECT_MANIFEST_SQL = """
+SELECT file_path, file_size, file_mtime_ns, content_hash
+FROM raw._load_manifest;
+"""
+
+UPSERT_MANIFEST_SQL = """
+INSERT INTO raw._load_manifest (
+    file_path, file_size, file_mtime_ns, content_hash, row_count, loaded_at
+)
+VALUES (%s, %s, %s, %s, %s, now())
+ON CONFLICT (file_path) DO UPDATE SET
+    file_size = EXCLUDED.file_size,
+    file_mtime_ns = EXCLUDED.file_mtime_ns,
+    content_hash = EXCLUDED.content_hash,
+    row_count = COALESCE(EXCLUDED.row_count, raw._load_manifest.row_count),
+    loaded_at = EXCLUDED.loaded_at;
+"""
+
+
+class LoadManifest:
+    """
+    Which raw landing files are already in ``raw.telegram_messages``.
+
+    Files are keyed by their path relative to the landing root. A file
+    whose size and mtime match its entry is skipped without being opened;
+    when only the mtime moved (a copy, a ``touch``) the content hash
+    decides, and an unchanged file just gets its stat refreshed. Entries
+    are written in the same transaction as the rows they describe, so a
+    failed load never marks a file as done.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.entries: Dict[str, Dict] = {}
+        # (size, mtime_ns, hash) computed during is_current, reused by record
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        # unchanged files whose stat moved; refreshed by record_touched
+        self.touched: List[Path] = []
+
+    def key(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    def load(self, cur) -> "LoadManifest":
+        cur.execute(CREATE_MANIFEST_SQL)
+        cur.execute(SELECT_MANIFEST_SQL)
+        self.entries = {
+            file_path: {
+                "file_size": size,
+                "file_mtime_ns": mtime_ns,
+                "content_hash": content_hash,
+            }
+            for file_path, size, mtime_ns, content_hash in cur.fetchall()
+        }
+        return self
+
+    def _hash(self, path: Path) -> str:
+        stat = path.stat()
+        key = self.key(path)
+        cached = self._hashes.get(key)
+        if cached is None or cached[:2] != (stat.st_size, stat.st_mtime_ns):
+            cached = (stat.st_size, stat.st_mtime_ns, file_sha256(path))
+            self._hashes[key] = cached
+        return cached[2]
+
+    def is_current(self, path: Path) -> bool:
+        """True when ``path`` was already loaded with the same content."""
+        entry: Optional[Dict] = self.entries.get(self.key(path))
+        if entry is None:
+            return False
+
+        stat = path.stat()
+        if stat.st_size != entry["file_size"]:
+            return False
+        if stat.st_mtime_ns == entry["file_mtime_ns"]:
+            return True
+        if self._hash(path) != entry["content_hash"]:
+            return False
+        self.touched.append(path)
+        return True
+
+    def record(self, cur, path: Path, row_count: Optional[int] = None) -> None:
+        """Upsert the entry for ``path``; commit with the loaded rows."""
+        stat = path.stat()
+        key = self.key(path)
+        content_hash = self._hash(path)
+        cur.execute(
+            UPSERT_MANIFEST_SQL,
+            (key, stat.st_size, stat.st_mtime_ns, content_hash, row_count),
+        )
+        self.entries[key] = {
+            "file_size": stat.st_size,
+            "file_mtime_ns": stat.st_mtime_ns,
+            "content_hash": content_hash,
+        }
+        self._hashes.pop(key, None)
+
+    def record_touched(self, cur) -> None:
+        for path in self.touched:
+            self.record(cur, path)
+        self.touched = []
@@ -0,0 +1,223 @@
+import logging
+from datetime import date, datetime
+from typing import Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_COLUMNS = """
+    message_id,
+    channel_name,
+    message_date,
+    message_text,
+    view_count,
+    forward_count,
+    has_media,
+    image_path,
+    ingested_at,
+    updated_at
+"""
+
+# Telegram message ids are only unique within a channel. The partition
+# key has to be part of the primary key; a message never changes its
+# date, so this is still one row per (channel_name, message_id).
+CREATE_PARTITIONED_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS raw.telegram_messages (
+    message_id     BIGINT NOT NULL,
+    channel_name   TEXT NOT NULL,
+    message_date   TIMESTAMP NOT NULL,
+    message_text   TEXT,
+    view_count     INT,
+    forward_count  INT,
+    has_media      BOOLEAN,
+    image_path     TEXT,
+    ingested_at    TIMESTAMP DEFAULT now(),
+    updated_at     TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (channel_name, message_id, message_date)
+) PARTITION BY RANGE (message_date);
+"""
+
+TABLE_KIND_SQL = """
+SELECT c.relkind
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'raw' AND c.relname = %s;
+"""
+
+LIST_PARTITIONS_SQL = """
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+JOIN pg_namespace n ON n.oid = p.relnamespace
+WHERE n.nspname = 'raw' AND p.relname = 'telegram_messages';
+"""
+
+# Serializes partition DDL between concurrent loaders
+PARTITION_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('raw.telegram_messages'));"
+
+LEGACY_MONTHS_SQL = """
+SELECT DISTINCT date_trunc('month', message_date)::date
+FROM raw.telegram_messages_legacy
+WHERE message_date IS NOT NULL;
+"""
+
+MIGRATE_ROWS_SQL = f"""
+INSERT INTO raw.telegram_messages ({MESSAGE_COLUMNS})
+SELECT {MESSAGE_COLUMNS}
+FROM raw.telegram_messages_legacy
+WHERE message_date IS NOT NULL
+ON CONFLICT DO NOTHING;
+"""
+
+
+def month_of(value) -> Optional[date]:
+    """First day of the month of a raw ``message_date`` (ISO string or datetime)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"telegram_messages_p{month:%Y_%m}"
+
+
+class MessagePartitions:
+    """
+    Monthly range partitions of ``raw.telegram_messages``.
+
+    ``ensure`` creates the partitions a batch needs before it is written,
+    so the loader never hits "no partition of relation found for row".
+    With ``hash_partitions`` > 1 every month is further split by a hash
+    of ``channel_name``. Known partitions are cached per connection; DDL
+    runs under a transaction-level advisory lock so parallel loaders do
+    not race each other.
+
+    Creating a partition takes an ACCESS EXCLUSIVE lock on the parent
+    table until commit, which stalls every other loader writing to it.
+    Loaders therefore commit what they have written so far, create the
+    ``missing`` months in a short transaction of their own and commit
+    that before loading the batch that needs them.
+    """
+
+    def __init__(self, hash_partitions: int = 0):
+        self.hash_partitions = int(hash_partitions or 0)
+        self.known: Set[str] = set()
+
+    def load(self, cur) -> "MessagePartitions":
+        cur.execute(LIST_PARTITIONS_SQL)
+        self.known = {name for (name,) in cur.fetchall()}
+        return self
+
+    def _create(self, cur, month: date) -> None:
+        name = partition_name(month)
+        if self.hash_partitions > 1:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS raw.{name}
+                PARTITION OF raw.telegram_messages
+                FOR VALUES FROM ('{month}') TO ('{next_month(month)}')
+                PARTITION BY HASH (channel_name);
+                """
+            )
+            for remainder in range(self.hash_partitions):
+                cur.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS raw.{name}_h{remainder}
+                    PARTITION OF raw.{name}
+                    FOR VALUES WITH (MODULUS {self.hash_partitions},
+                                     REMAINDER {remainder});
+                    """
+                )
+        else:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS raw.{name}
+                PARTITION OF raw.telegram_messages
+                FOR VALUES FROM ('{month}') TO ('{next_month(month)}');
+                """
+            )
+        self.known.add(name)
+        logger.info(f"Created partition raw.{name}")
+
+    def create(self, cur, months: Iterable[date]) -> None:
+        """Create partitions for ``months`` in the transaction of ``cur``."""
+        cur.execute(PARTITION_LOCK_SQL)
+        for month in sorted(set(months)):
+            self._create(cur, month)
+
+    def missing(self, batch: Iterable[Tuple]) -> Set[date]:
+        """Months of the message_dates in ``batch`` without a known partition."""
+        months = {month_of(row[2]) for row in batch} - {None}
+        return {m for m in months if partition_name(m) not in self.known}
+
+    def ensure_months(self, cur, months: Iterable[date]) -> None:
+        missing = [m for m in set(months) if partition_name(m) not in self.known]
+        if missing:
+            self.create(cur, missing)
+
+    def ensure(self, cur, batch: Iterable[Tuple]) -> None:
+        """Create the partitions for every message_date in ``batch``."""
+        self.ensure_months(cur, self.missing(batch))
+
+
+def setup_table(cur, partitions: MessagePartitions) -> None:
+    """
+    Create the partitioned ``raw.telegram_messages``, migrating a plain
+    table left by earlier loader versions.
+
+    The old table is renamed to ``raw.telegram_messages_legacy`` and its
+    rows are copied into monthly partitions; rows without a
+    ``message_date`` cannot be routed and stay behind in the legacy
+    table, which is kept for inspection. Views on the old table follow
+    the rename until dbt rebuilds them.
+    """
+    cur.execute(TABLE_KIND_SQL, ("telegram_messages",))
+    kind = cur.fetchone()
+    if kind is None or kind[0] != "p":
+        # Re-check under the lock: another loader may have just done it
+        cur.execute(PARTITION_LOCK_SQL)
+        cur.execute(TABLE_KIND_SQL, ("telegram_messages",))
+        kind = cur.fetchone()
+
+    if kind is not None and kind[0] == "p":
+        partitions.load(cur)
+        return
+
+    if kind is not None:
+        logger.info("Migrating raw.telegram_messages to a partitioned table")
+        cur.execute(
+            "ALTER TABLE raw.telegram_messages "
+            "ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();"
+        )
+        cur.execute(
+            "ALTER TABLE raw.telegram_messages RENAME TO telegram_messages_legacy;"
+        )
+        cur.execute(
+            "ALTER INDEX IF EXISTS raw.telegram_messages_pkey "
+            "RENAME TO telegram_messages_legacy_pkey;"
+        )
+
+    cur.execute(CREATE_PARTITIONED_TABLE_SQL)
+    partitions.load(cur)
+
+    if kind is not None:
+        cur.execute(LEGACY_MONTHS_SQL)
+        partitions.create(cur, [month for (month,) in cur.fetchall()])
+        cur.execute(MIGRATE_ROWS_SQL)
+        migrated = cur.rowcount
+        cur.execute(
+            "SELECT count(*) FROM raw.telegram_messages_legacy "
+            "WHERE message_date IS NULL;"
+        )
+        undated = cur.fetchone()[0]
+        logger.info(
+            f"Migrated {migrated} rows; {undated} rows without message_date "
+            "left in raw.telegram_messages_legacy, which can be dropped once "
+            "the new table is verified"
+        )
@@ -1,106 +1,271 @@
-import os
+import csv
 import sys
 import logging
+import argparse
 from pathlib import Path
-import psycopg2
-from dotenv import load_dotenv
+from typing import IO, List
 from medi_tg_analytics.core.settings import settings
+from medi_tg_analytics.db.pool import connection
 
 # ------------------------------------------------------------------
 # Setup & Paths
 # ------------------------------------------------------------------
-load_dotenv()
 
-# Ensure this matches your actual filename from Task 3
-YOLO_CSV_PATH: Path = settings.paths.DATA["raw_dir"] / \
+# Written by the optional CSV sink of enrichment/yolo_detect.py
+YOLO_CSV_PATH: Path = settings.paths.DATA["interim_dir"] / \
     "yolo_image_detections.csv"
 FLAG_FILE: Path = settings.paths.DATA["interim_dir"] / "yolo_loaded.flag"
 
+# Detections written before the CSV carried a model_version column
+DEFAULT_MODEL_VERSION = settings.get("yolo", {}).get("model", "yolov8n.pt")
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s | %(levelname)s | %(message)s",
 )
 
 
-def get_connection():
-    try:
-        return psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-        )
-    except psycopg2.Error as e:
-        logging.error(f" Database connection failed: {e}")
-        sys.exit(1)
-
-
 # ------------------------------------------------------------------
 # SQL Definitions
 # ------------------------------------------------------------------
-# Explicitly matching your 5 CSV fields
+CSV_COLUMNS = [
+    "message_id",
+    "channel_name",
+    "detected_class",
+    "confidence_score",
+    "image_category",
+    "model_version",
+]
+
 CREATE_TABLE_SQL = """
-CREATE TABLE raw.yolo_image_detections (
+CREATE TABLE IF NOT EXISTS raw.yolo_image_detections (
     message_id       BIGINT,
     channel_name     TEXT,
     detected_class   TEXT,
     confidence_score NUMERIC(5,4),
     image_category   TEXT,
+    model_version    TEXT,
     ingested_at      TIMESTAMP DEFAULT now()
 );
 """
 
+MODEL_VERSION_COLUMN_SQL = """
+SELECT 1
+FROM information_schema.columns
+WHERE table_schema = 'raw'
+  AND table_name = 'yolo_image_detections'
+  AND column_name = 'model_version';
+"""
+
+# Tables created by the old drop-and-recreate loader lack model_version;
+# their rows are backfilled once, when the column is added
+MIGRATE_TABLE_SQL = """
+ALTER TABLE raw.yolo_image_detections
+    ADD COLUMN IF NOT EXISTS model_version TEXT;
+UPDATE raw.yolo_image_detections
+SET model_version = %(model_version)s
+WHERE model_version IS NULL;
+"""
 
-def load_yolo_csv_to_raw():
+CREATE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS yolo_image_detections_image_idx
+    ON raw.yolo_image_detections (channel_name, message_id, model_version);
+"""
+
+# Shadow copy of the CSV; the live table is only touched once it is
+# complete. _stage_yolo_images lists the images whose rows the staged
+# ones supersede, including images that no longer have any detection.
+CREATE_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS _stage_yolo_image_detections (
+    message_id       BIGINT,
+    channel_name     TEXT,
+    detected_class   TEXT,
+    confidence_score NUMERIC(5,4),
+    image_category   TEXT,
+    model_version    TEXT
+);
+CREATE TEMP TABLE IF NOT EXISTS _stage_yolo_images (
+    message_id       BIGINT,
+    channel_name     TEXT,
+    model_version    TEXT
+);
+TRUNCATE _stage_yolo_image_detections, _stage_yolo_images;
+"""
+
+IMAGE_COLUMNS = ["message_id", "channel_name", "model_version"]
+
+INSERT_STAGE_SQL = """
+INSERT INTO raw.yolo_image_detections (
+    message_id, channel_name, detected_class,
+    confidence_score, image_category, model_version
+)
+SELECT
+    s.message_id, s.channel_name, s.detected_class,
+    s.confidence_score, s.image_category,
+    COALESCE(s.model_version, %(model_version)s)
+FROM _stage_yolo_image_detections s"""
+
+# An image is (channel, message_id, model_version); its detections are
+# appended only if that model has never been run on it before
+APPEND_SQL = f"""{INSERT_STAGE_SQL}
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM raw.yolo_image_detections t
+    WHERE t.channel_name = s.channel_name
+      AND t.message_id = s.message_id
+      AND t.model_version = COALESCE(s.model_version, %(model_version)s)
+);
+"""
+
+# Staged images had their detections (re)computed, so whatever the table
+# holds for them, e.g. from other thresholds or a different per-image
+# limit, is replaced. Only the Postgres sink stages just the images that
+# changed; the CSV lists every image and goes through APPEND_SQL.
+REPLACE_IMAGES_SQL = f"""
+DELETE FROM raw.yolo_image_detections t
+USING (
+    SELECT channel_name, message_id, model_version
+    FROM _stage_yolo_images
+    UNION
+    SELECT channel_name, message_id, COALESCE(model_version, %(model_version)s)
+    FROM _stage_yolo_image_detections
+) s
+WHERE t.channel_name = s.channel_name
+  AND t.message_id = s.message_id
+  AND t.model_version = s.model_version;
+{INSERT_STAGE_SQL};
+"""
+
+# Replace the contents in one transaction. Readers keep seeing the old
+# rows until commit (DELETE does not block them the way TRUNCATE or DROP
+# does), and dependent views stay attached to the same table.
+REPLACE_SQL = f"""
+DELETE FROM raw.yolo_image_detections;
+{INSERT_STAGE_SQL};
+"""
+
+PUBLISH_SQL = {
+    "append": APPEND_SQL,
+    "replace_images": REPLACE_IMAGES_SQL,
+    "full_refresh": REPLACE_SQL,
+}
+
+
+def csv_columns(csv_path: Path) -> List[str]:
+    """Header of the detections CSV, validated against the table columns."""
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), [])
+    unknown = [c for c in header if c not in CSV_COLUMNS]
+    if unknown or not header:
+        raise ValueError(f"Unexpected columns in {csv_path.name}: {header}")
+    return header
+
+
+def prepare_tables(cur) -> None:
+    """Create / migrate the detections table and an empty shadow table."""
+    cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+    cur.execute(CREATE_TABLE_SQL)
+    cur.execute(MODEL_VERSION_COLUMN_SQL)
+    if cur.fetchone() is None:
+        logging.info(f"Backfilling model_version with {DEFAULT_MODEL_VERSION}")
+        cur.execute(MIGRATE_TABLE_SQL, {"model_version": DEFAULT_MODEL_VERSION})
+    cur.execute(CREATE_INDEX_SQL)
+    cur.execute(CREATE_STAGE_SQL)
+
+
+def copy_to_stage(
+    cur,
+    f: IO,
+    columns: List[str],
+    header: bool = True,
+    table: str = "_stage_yolo_image_detections",
+) -> int:
+    """COPY CSV detections (or image keys) from ``f`` into a shadow table."""
+    # COPY is the fastest method for CSV loading in Postgres
+    copy_sql = f"""
+        COPY {table}({", ".join(columns)})
+        FROM STDIN WITH (FORMAT CSV, HEADER {str(header).upper()});
+    """
+    cur.copy_expert(copy_sql, f)
+    return cur.rowcount
+
+
+def publish_stage(cur, mode: str = "append") -> int:
+    """
+    Move the shadow table into ``raw.yolo_image_detections``.
+
+    ``mode`` is ``append`` (new images only), ``replace_images`` (the
+    staged images' rows are replaced) or ``full_refresh``.
+    """
+    if mode not in PUBLISH_SQL:
+        raise ValueError(
+            f"Unknown publish mode {mode!r}; expected one of {sorted(PUBLISH_SQL)}"
+        )
+    params = {"model_version": DEFAULT_MODEL_VERSION}
+    cur.execute(PUBLISH_SQL[mode], params)
+    return cur.rowcount
+
+
+def write_flag() -> None:
+    # Create flag for Dagster/DVC
+    FLAG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(FLAG_FILE, "w") as f:
+        f.write("yolo_loaded")
+
+
+def load_yolo_csv_to_raw(full_refresh: bool = False):
+    """
+    Load detections into ``raw.yolo_image_detections`` without downtime.
+
+    The CSV is COPYed into a session-local shadow table first. By default
+    only images the current model has not been run on are appended, so a
+    run only writes what is new; ``full_refresh`` swaps the table contents
+    for the shadow copy in a single transaction instead. Detections of
+    images re-run with other settings reach the table through the
+    Postgres sink of ``yolo_detect`` or a full refresh.
+    """
     if not YOLO_CSV_PATH.exists():
         logging.error(f"YOLO CSV not found: {YOLO_CSV_PATH}")
         sys.exit(1)
 
-    conn = get_connection()
-    cur = conn.cursor()
-
     try:
-        logging.info("Dropping old table to refresh schema...")
-        # CASCADE ensures any dependent views are also handled
-        cur.execute("DROP TABLE IF EXISTS raw.yolo_image_detections CASCADE;")
-
-        logging.info("Creating fresh table with 5 columns...")
-        cur.execute(CREATE_TABLE_SQL)
-        conn.commit()
-
-        logging.info(f"Streaming data from {YOLO_CSV_PATH.name}...")
-
-        with open(YOLO_CSV_PATH, 'r', encoding='utf-8') as f:
-            # COPY is the fastest method for CSV loading in Postgres
-            copy_sql = """
-                COPY raw.yolo_image_detections(
-                    message_id, 
-                    channel_name, 
-                    detected_class, 
-                    confidence_score, 
-                    image_category
-                )
-                FROM STDIN WITH (FORMAT CSV, HEADER TRUE);
-            """
-            cur.copy_expert(copy_sql, f)
+        columns = csv_columns(YOLO_CSV_PATH)
 
-        conn.commit()
-        logging.info(f"Successfully loaded all detections.")
+        with connection("bulk") as conn:
+            cur = conn.cursor()
+            prepare_tables(cur)
+            conn.commit()
 
-        # Create flag for Dagster/DVC
-        FLAG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(FLAG_FILE, "w") as f:
-            f.write("yolo_loaded")
+            logging.info(f"Streaming data from {YOLO_CSV_PATH.name}...")
+
+            with open(YOLO_CSV_PATH, 'r', encoding='utf-8') as f:
+                staged = copy_to_stage(cur, f, columns)
+
+            published = publish_stage(
+                cur, "full_refresh" if full_refresh else "append"
+            )
+            if full_refresh:
+                logging.info(f"Replaced detections with {published} rows")
+            else:
+                logging.info(
+                    f"Appended {published} of {staged} detections "
+                    "(the rest belong to images already loaded)"
+                )
+            conn.commit()
+            write_flag()
 
     except Exception as e:
-        conn.rollback()
+        # Uncommitted work is rolled back when the connection is returned
         logging.error(f"Critical error during load: {e}")
         sys.exit(1)  # Crucial for Dagster to catch the failure
-    finally:
-        cur.close()
-        conn.close()
 
 
 if __name__ == "__main__":
-    load_yolo_csv_to_raw()
+    parser = argparse.ArgumentParser(description="Load YOLO detections")
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Replace every detection instead of appending new images",
+    )
+    args = parser.parse_args()
+    load_yolo_csv_to_raw(full_refresh=args.full_refresh)
@@ -0,0 +1,67 @@
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from medi_tg_analytics.utils.files import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """
+    Per-channel scrape checkpoints persisted as a small JSON document.
+
+    Each channel keeps its high-water mark: the highest Telegram
+    ``message_id`` that has been committed to the raw landing zone. While
+    a channel is being scraped it may also carry a ``partial`` entry that
+    describes how far the in-progress temp file got, so a crashed run can
+    resume there. The file is rewritten atomically (temp file + rename)
+    on every update, so a crash never leaves a half-written checkpoint.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._state: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("checkpoint root must be a dict")
+            return data
+        except Exception as exc:
+            logger.warning(f"Ignoring unreadable checkpoint file {self.path}: {exc}")
+            return {}
+
+    def high_water_mark(self, channel_name: str) -> int:
+        """Highest committed message_id for a channel, 0 if never scraped."""
+        return int(self._state.get(channel_name, {}).get("last_message_id", 0))
+
+    def commit(self, channel_name: str, last_message_id: int) -> None:
+        """Record a new high-water mark once its output file is committed."""
+        entry = self._state.setdefault(channel_name, {})
+        entry["last_message_id"] = int(last_message_id)
+        entry["updated_at"] = datetime.utcnow().isoformat()
+        entry.pop("partial", None)
+        self.save()
+
+    def partial(self, channel_name: str) -> Optional[Dict]:
+        """In-progress scrape state left by an interrupted run, if any."""
+        return self._state.get(channel_name, {}).get("partial")
+
+    def save_partial(self, channel_name: str, state: Dict) -> None:
+        entry = self._state.setdefault(channel_name, {})
+        entry["partial"] = dict(state, updated_at=datetime.utcnow().isoformat())
+        self.save()
+
+    def clear_partial(self, channel_name: str) -> None:
+        if self._state.get(channel_name, {}).pop("partial", None) is not None:
+            self.save()
+
+    def save(self) -> None:
+        atomic_write_json(self.path, self._state, indent=2)
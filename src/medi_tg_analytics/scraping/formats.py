@@ -0,0 +1,491 @@
+import io
+import os
+import re
+import gzip
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+try:
+    import zstandard as zstd
+except ImportError:  # optional: pip install zstandard
+    zstd = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: pip install pyarrow
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Compression codecs
+# ------------------------------------------------------------------
+
+CODEC_SUFFIXES = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+
+def _require_codec(codec: str) -> None:
+    if codec not in CODEC_SUFFIXES:
+        raise ValueError(
+            f"Unknown compression {codec!r}; expected one of {sorted(CODEC_SUFFIXES)}"
+        )
+    if codec == "zstd" and zstd is None:
+        raise RuntimeError("zstd compression requires the 'zstandard' package")
+
+
+class _Compressor:
+    """
+    Byte stream on top of a raw file that can be cut into independently
+    decodable segments (gzip members / zstd frames). Concatenated segments
+    form a valid file, which is what lets a checkpointed temp file be
+    truncated and appended to.
+    """
+
+    def __init__(self, raw, codec: str, level: int = None):
+        self.raw = raw
+        self.codec = codec
+        self.level = level
+        self._stream = None
+        self._begin()
+
+    def _begin(self) -> None:
+        if self.codec == "gzip":
+            self._stream = gzip.GzipFile(
+                fileobj=self.raw,
+                mode="wb",
+                compresslevel=6 if self.level is None else self.level,
+            )
+        elif self.codec == "zstd":
+            cctx = zstd.ZstdCompressor(level=3 if self.level is None else self.level)
+            self._stream = cctx.stream_writer(self.raw, closefd=False)
+        else:
+            self._stream = self.raw
+
+    def _end(self) -> None:
+        if self._stream is not self.raw:
+            # Ends the gzip member / zstd frame; the raw file stays open
+            self._stream.close()
+        self.raw.flush()
+
+    def write(self, data: bytes) -> None:
+        self._stream.write(data)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+    def sync(self) -> int:
+        """Close the current segment, fsync, and return the byte offset."""
+        self._end()
+        os.fsync(self.raw.fileno())
+        offset = self.raw.tell()
+        self._begin()
+        return offset
+
+    def close(self) -> None:
+        self._end()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+
+    def discard(self) -> None:
+        """Close without finishing the segment (abort / keep for resume)."""
+        self.raw.close()
+
+
+# ------------------------------------------------------------------
+# Writers
+# ------------------------------------------------------------------
+
+
+class RecordWriter:
+    """
+    Stream scraped records into ``<channel>.tmp`` and atomically rename
+    it to the final output file on commit.
+
+    Records are encoded and written one by one, so memory stays flat no
+    matter how large the channel is. The temp file is flushed every
+    ``flush_every`` records and may be compressed on the fly with gzip
+    or zstd.
+    """
+
+    suffix = ""
+    # Whether checkpoint()/resume() can cut and reopen the temp file
+    supports_resume = False
+
+    def __init__(
+        self,
+        base_path: Path,
+        flush_every: int = 100,
+        compression: str = "none",
+        compression_level: int = None,
+    ):
+        _require_codec(compression)
+        base_path = Path(base_path)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.output_file = base_path.with_name(
+            base_path.name + self.suffix + CODEC_SUFFIXES[compression]
+        )
+        self.temp_file = base_path.with_name(base_path.name + ".tmp")
+        self.flush_every = max(1, int(flush_every))
+        self.count = 0
+        self._fh = None
+
+    # -- format hooks ------------------------------------------------
+    def _start(self):
+        pass
+
+    def _encode(self, record: Dict) -> bytes:
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    # -- lifecycle ---------------------------------------------------
+    def _wrap(self, raw) -> _Compressor:
+        return _Compressor(raw, self.compression, self.compression_level)
+
+    def open(self) -> "RecordWriter":
+        self._fh = self._wrap(open(self.temp_file, "wb"))
+        self._start()
+        return self
+
+    def write(self, record: Dict) -> None:
+        self._fh.write(self._encode(record))
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._fh.flush()
+
+    def commit(self, carry_over: Iterable[Dict] = ()) -> Path:
+        """Append ``carry_over`` records, finalize and rename into place."""
+        for record in carry_over:
+            self.write(record)
+        self._finish()
+        self._fh.close()
+        self._fh = None
+        self.temp_file.replace(self.output_file)
+        return self.output_file
+
+    def close(self) -> None:
+        """Close the temp file but keep it on disk for a later resume."""
+        if self._fh is not None:
+            self._fh.discard()
+            self._fh = None
+
+    def abort(self) -> None:
+        self.close()
+        self.temp_file.unlink(missing_ok=True)
+
+
+class ResumableRecordWriter(RecordWriter):
+    """
+    A ``RecordWriter`` whose temp file can be checkpointed mid-channel and
+    reopened there by a later run.
+
+    Each checkpoint closes the current gzip member / zstd frame, so the
+    bytes up to its offset stay a valid file on their own.
+    """
+
+    supports_resume = True
+
+    def resume(self, offset: int, count: int) -> "ResumableRecordWriter":
+        """
+        Reopen the temp file at a checkpoint taken by ``checkpoint``.
+
+        Anything written after the checkpoint is truncated away, so the
+        records re-fetched by the resumed run are not duplicated.
+        """
+        raw = open(self.temp_file, "r+b")
+        raw.truncate(offset)
+        raw.seek(offset)
+        self._fh = self._wrap(raw)
+        self.count = count
+        return self
+
+    def checkpoint(self) -> int:
+        """Make everything written so far durable; return the byte offset."""
+        return self._fh.sync()
+
+
+class JsonArrayWriter(ResumableRecordWriter):
+    """A single JSON array, one element per line."""
+
+    suffix = ".json"
+
+    def _start(self):
+        self._fh.write(b"[")
+
+    def _encode(self, record: Dict) -> bytes:
+        sep = b",\n" if self.count else b"\n"
+        return sep + json.dumps(record, ensure_ascii=False).encode("utf-8")
+
+    def _finish(self):
+        self._fh.write(b"\n]\n")
+
+
+class NdjsonWriter(ResumableRecordWriter):
+    """Newline-delimited JSON: one record per line."""
+
+    suffix = ".jsonl"
+
+    def _encode(self, record: Dict) -> bytes:
+        return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Parquet output requires the 'pyarrow' package")
+
+
+def message_schema():
+    """Fixed, typed schema of a raw message partition file."""
+    _require_pyarrow()
+    return pa.schema(
+        [
+            ("message_id", pa.int64()),
+            ("channel_name", pa.string()),
+            ("message_date", pa.timestamp("us", tz="UTC")),
+            ("message_text", pa.string()),
+            ("views", pa.int64()),
+            ("forwards", pa.int64()),
+            ("has_media", pa.bool_()),
+            ("image_path", pa.string()),
+        ]
+    )
+
+
+class ParquetRecordWriter(RecordWriter):
+    """
+    One Parquet file per channel/date partition with ``message_schema``.
+
+    Records are buffered and written as row groups of ``row_group_size``,
+    so memory is bounded by one row group. ``compression`` selects the
+    Parquet column codec; the file name carries no codec suffix. A
+    Parquet file is only readable once its footer is written, so
+    mid-channel checkpoints are not supported.
+    """
+
+    suffix = ".parquet"
+
+    def __init__(
+        self,
+        base_path: Path,
+        flush_every: int = 100,
+        compression: str = "none",
+        compression_level: int = None,
+        row_group_size: int = 10000,
+    ):
+        _require_pyarrow()
+        super().__init__(base_path, flush_every=flush_every)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.row_group_size = max(1, int(row_group_size))
+        self._schema = message_schema()
+        self._buffer = []
+
+    def open(self) -> "ParquetRecordWriter":
+        options = {"compression": self.compression}
+        # Arrow rejects a level for codecs that have none (none, snappy)
+        if (
+            self.compression_level is not None
+            and self.compression != "none"
+            and pa.Codec.supports_compression_level(self.compression)
+        ):
+            options["compression_level"] = self.compression_level
+        self._fh = pq.ParquetWriter(self.temp_file, self._schema, **options)
+        return self
+
+    def _flush_row_group(self) -> None:
+        if self._buffer:
+            table = pa.Table.from_pylist(self._buffer, schema=self._schema)
+            self._fh.write_table(table, row_group_size=self.row_group_size)
+            self._buffer = []
+
+    def write(self, record: Dict) -> None:
+        record = dict(record)
+        date = record.get("message_date")
+        if isinstance(date, str):
+            record["message_date"] = datetime.fromisoformat(date)
+        self._buffer.append(record)
+        self.count += 1
+        if len(self._buffer) >= self.row_group_size:
+            self._flush_row_group()
+
+    def commit(self, carry_over: Iterable[Dict] = ()) -> Path:
+        for record in carry_over:
+            self.write(record)
+        self._flush_row_group()
+        self._fh.close()
+        self._fh = None
+        self.temp_file.replace(self.output_file)
+        return self.output_file
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self._buffer = []
+
+
+OUTPUT_FORMATS = {
+    "json": JsonArrayWriter,
+    "ndjson": NdjsonWriter,
+    "parquet": ParquetRecordWriter,
+}
+
+
+def open_writer(
+    base_path: Path,
+    fmt: str = "json",
+    flush_every: int = 100,
+    compression: str = "none",
+    compression_level: int = None,
+):
+    try:
+        writer_cls = OUTPUT_FORMATS[fmt]
+    except KeyError:
+        raise ValueError(
+            f"Unknown output format {fmt!r}; expected one of {sorted(OUTPUT_FORMATS)}"
+        )
+    return writer_cls(
+        base_path,
+        flush_every=flush_every,
+        compression=compression,
+        compression_level=compression_level,
+    )
+
+
+# ------------------------------------------------------------------
+# Readers
+# ------------------------------------------------------------------
+
+RAW_SUFFIXES = (".json", ".jsonl", ".parquet")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def split_suffix(path: Path):
+    """Return (format suffix, codec) for a raw landing file name."""
+    path = Path(path)
+    codec = "none"
+    stem = path
+    for name, ext in CODEC_SUFFIXES.items():
+        if ext and path.suffix == ext:
+            codec = name
+            stem = path.with_suffix("")
+            break
+    return stem.suffix, codec
+
+
+def is_raw_file(path: Path) -> bool:
+    return path.is_file() and split_suffix(path)[0] in RAW_SUFFIXES
+
+
+def _open_text(path: Path, codec: str):
+    if codec == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if codec == "zstd":
+        _require_codec(codec)
+        reader = zstd.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _iter_json_array(f, chunk_size: int = 1 << 16) -> Iterator:
+    """
+    Yield the elements of a top-level JSON array from text stream ``f``.
+
+    The stream is read in chunks and each element is decoded as soon as
+    it is complete, so memory is bounded by the largest element rather
+    than the file. An element is only yielded once the ``,`` or ``]``
+    after it has been read, so a number cut off at a chunk boundary is
+    never decoded early. A truncated array raises ``JSONDecodeError``
+    after the elements before the tear have been yielded.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    expect = "["
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+            continue
+
+        char = buf[pos]
+        if expect == "[":
+            if char != "[":
+                raise json.JSONDecodeError("Expected a JSON array", buf, pos)
+            pos += 1
+            expect = "first"
+        elif expect != "value" and char == "]":
+            return
+        elif expect == "sep":
+            if char != ",":
+                raise json.JSONDecodeError("Expected ',' or ']'", buf, pos)
+            pos += 1
+            expect = "value"
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                after = _WHITESPACE.match(buf, end).end()
+                complete = eof or buf[after:after + 1] in (",", "]")
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield value
+            pos = end
+            expect = "sep"
+
+
+def read_records(path: Path) -> Iterator[Dict]:
+    """
+    Yield message records from a raw landing file of any known format.
+
+    Every format is streamed: NDJSON line by line, Parquet by record
+    batch and JSON arrays element by element.
+    """
+    path = Path(path)
+    fmt, codec = split_suffix(path)
+
+    if fmt == ".parquet":
+        # Typed columns: message_date arrives as a datetime, not a string
+        _require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=5000):
+            yield from batch.to_pylist()
+        return
+
+    with _open_text(path, codec) as f:
+        if fmt == ".jsonl":
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as exc:
+                    # A torn last line from a killed writer is not fatal
+                    logger.warning(f"Skipping bad line {line_no} in {path}: {exc}")
+            return
+
+        yield from _iter_json_array(f)
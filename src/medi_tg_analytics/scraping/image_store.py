@@ -0,0 +1,106 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from medi_tg_analytics.utils.files import atomic_write_json, file_sha256
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore:
+    """
+    Local image store for scraped photos.
+
+    - ``is_valid`` lets the scraper skip downloads whose target file is
+      already on disk, complete, from an earlier run.
+    - ``register`` hashes a freshly downloaded file and, if the same
+      content is already stored elsewhere (a promo reposted across
+      channels), replaces the new copy with a hard link to the first one.
+
+    The hash index is a JSON document rewritten atomically by ``save``.
+    """
+
+    def __init__(self, index_path: Path):
+        self.index_path = Path(index_path)
+        self._lock = threading.Lock()
+        self._by_hash: Dict[str, str] = {}
+        self._by_path: Dict[str, str] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._by_hash = dict(data.get("hashes", {}))
+            self._by_path = dict(data.get("paths", {}))
+        except Exception as exc:
+            logger.warning(f"Ignoring unreadable image index {self.index_path}: {exc}")
+
+    @staticmethod
+    def is_valid(path: Path, expected_size: Optional[int] = None) -> bool:
+        """
+        An existing, non-empty file counts as a completed download; one of
+        another size than ``expected_size`` (when known) was cut short.
+        """
+        try:
+            if not path.is_file():
+                return False
+            size = path.stat().st_size
+        except OSError:
+            return False
+        if expected_size is not None:
+            return size == expected_size
+        return size > 0
+
+    def hash_of(self, path: Path) -> Optional[str]:
+        return self._by_path.get(str(path))
+
+    def forget(self, path: Path) -> None:
+        """Drop ``path`` from the index before it is downloaded again."""
+        with self._lock:
+            digest = self._by_path.pop(str(path), None)
+            if digest is not None and self._by_hash.get(digest) == str(path):
+                del self._by_hash[digest]
+
+    def register(self, path: Path) -> Path:
+        """
+        Index ``path`` by content hash and return the canonical copy.
+
+        Duplicates are hard-linked to the canonical file so they share
+        one inode; if the filesystem refuses, the copy is kept.
+        """
+        path = Path(path)
+        if str(path) in self._by_path:
+            return Path(self._by_hash.get(self._by_path[str(path)], path))
+
+        digest = file_sha256(path)
+
+        with self._lock:
+            canonical = self._by_hash.get(digest)
+            if canonical is None or not Path(canonical).is_file():
+                self._by_hash[digest] = str(path)
+                canonical = str(path)
+            self._by_path[str(path)] = digest
+
+        if canonical != str(path):
+            link_tmp = path.with_name(path.name + ".link")
+            try:
+                link_tmp.unlink(missing_ok=True)
+                os.link(canonical, link_tmp)
+                os.replace(link_tmp, path)
+                logger.info(f"Linked duplicate image {path} -> {canonical}")
+            except OSError as exc:
+                link_tmp.unlink(missing_ok=True)
+                logger.debug(f"Could not hard-link {path} to {canonical}: {exc}")
+
+        return Path(canonical)
+
+    def save(self) -> None:
+        with self._lock:
+            data = {"hashes": dict(self._by_hash), "paths": dict(self._by_path)}
+        atomic_write_json(self.index_path, data)
@@ -0,0 +1,144 @@
+import time
+import asyncio
+import logging
+from typing import Dict
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket limiter shared by every Telegram request of a scrape.
+
+    Each request takes one token; tokens refill at ``rate`` per second up
+    to ``burst``. When Telegram answers with FloodWait, only the affected
+    call sleeps for the requested time and is retried, while the shared
+    rate is cut by ``backoff_factor``. Every successful call then nudges
+    the rate back up by ``recovery_step`` until ``max_rate``.
+    """
+
+    def __init__(
+        self,
+        rate: float = 20.0,
+        burst: int = 20,
+        min_rate: float = 0.5,
+        max_rate: float = None,
+        backoff_factor: float = 0.5,
+        recovery_step: float = 0.05,
+        max_flood_retries: int = 5,
+    ):
+        self.rate = float(rate)
+        self.capacity = max(1, int(burst))
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate or rate)
+        self.backoff_factor = float(backoff_factor)
+        self.recovery_step = float(recovery_step)
+        self.max_flood_retries = int(max_flood_retries)
+
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        self.stats: Dict[str, float] = {
+            "requests": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "flood_waits": 0,
+            "flood_wait_seconds": 0.0,
+        }
+
+    # -- token bucket ------------------------------------------------
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+            self.stats["requests"] += 1
+
+    # -- adaptation --------------------------------------------------
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+    def on_flood_wait(self, seconds: float) -> None:
+        self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+        self.stats["flood_waits"] += 1
+        self.stats["flood_wait_seconds"] += seconds
+        logger.warning(
+            f"FloodWait of {seconds}s; request rate lowered to {self.rate:.2f}/s"
+        )
+
+    # -- wrappers ----------------------------------------------------
+    async def call(self, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` under the limiter, retrying FloodWait."""
+        for attempt in range(self.max_flood_retries + 1):
+            await self.acquire()
+            try:
+                result = await fn(*args, **kwargs)
+            except FloodWaitError as exc:
+                self.on_flood_wait(exc.seconds)
+                if attempt == self.max_flood_retries:
+                    raise
+                await asyncio.sleep(exc.seconds)
+                continue
+            self.on_success()
+            return result
+
+    async def iter_messages(self, client, entity, limit=None, page_size=100, **kwargs):
+        """
+        ``client.iter_messages`` with one token per page of ``page_size``.
+
+        On FloodWait the iteration sleeps, then resumes past the last
+        message it yielded (``offset_id``; below it, or above it when
+        ``reverse=True``), so nothing is repeated or lost.
+        Only FloodWaits without progress in between count towards
+        ``max_flood_retries``; a long listing may be throttled any number
+        of times as long as every retry gets further.
+        """
+        offset_id = kwargs.pop("offset_id", 0)
+        fetched = 0
+        flood_retries = 0
+        fetched_at_flood = 0
+
+        while limit is None or fetched < limit:
+            remaining = None if limit is None else limit - fetched
+            await self.acquire()
+            try:
+                in_page = 0
+                async for message in client.iter_messages(
+                    entity, limit=remaining, offset_id=offset_id, **kwargs
+                ):
+                    yield message
+                    fetched += 1
+                    offset_id = message.id
+                    in_page += 1
+                    if in_page >= page_size:
+                        self.on_success()
+                        await self.acquire()
+                        in_page = 0
+            except FloodWaitError as exc:
+                self.on_flood_wait(exc.seconds)
+                if fetched > fetched_at_flood:
+                    flood_retries = 0
+                fetched_at_flood = fetched
+                flood_retries += 1
+                if flood_retries > self.max_flood_retries:
+                    raise
+                await asyncio.sleep(exc.seconds)
+                continue
+
+            self.on_success()
+            return
@@ -1,14 +1,21 @@
 import os
-import json
+import sys
 import asyncio
 import logging
+import argparse
 from datetime import datetime
+from pathlib import Path
+from typing import Optional
 
 from telethon import TelegramClient
-from telethon.tl.types import MessageMediaPhoto
+from telethon.tl.types import MessageMediaPhoto, PhotoSize, PhotoSizeProgressive
 from dotenv import load_dotenv
 
 from medi_tg_analytics.core.settings import settings
+from medi_tg_analytics.scraping.checkpoints import CheckpointStore
+from medi_tg_analytics.scraping.formats import open_writer, read_records
+from medi_tg_analytics.scraping.image_store import ImageStore
+from medi_tg_analytics.scraping.rate_limit import AdaptiveRateLimiter
 
 # ------------------------------------------------------------------
 # Environment & Paths
@@ -18,6 +25,8 @@ load_dotenv()
 DATA_RAW = settings.paths.DATA["raw_dir"]
 MESSAGES_DIR = DATA_RAW / "telegram_messages"
 IMAGES_DIR = DATA_RAW / "images"
+CHECKPOINT_FILE = settings.paths.DATA["scraper_state_dir"] / "checkpoints.json"
+IMAGE_INDEX_FILE = settings.paths.DATA["scraper_state_dir"] / "image_index.json"
 LOG_DIR = settings.paths.LOGS["scraping_logs_dir"]
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -45,7 +54,160 @@ def safe_channel_name(name: str) -> str:
 # ------------------------------------------------------------------
 # Core scraper
 # ------------------------------------------------------------------
-async def scrape_channel(client: TelegramClient, channel: str, max_messages=None):
+def carry_over_records(output_file, min_id: int):
+    """Records already committed to today's partition by an earlier run."""
+    if not min_id or not output_file.exists():
+        return
+    try:
+        for record in read_records(output_file):
+            if (record.get("message_id") or 0) <= min_id:
+                yield record
+    except Exception as exc:
+        logger.warning(f"Could not read existing {output_file}: {exc}")
+
+
+def resumable_state(checkpoints, channel_name, writer, date_partition, min_id):
+    """
+    Return the partial checkpoint of an interrupted run if it can be
+    resumed by this one: same partition, same format, same starting
+    high-water mark and the temp file still holds the checkpointed bytes.
+    Stale partial state is discarded.
+    """
+    if checkpoints is None:
+        return None
+    partial = checkpoints.partial(channel_name)
+    if not partial:
+        return None
+
+    temp_file = writer.temp_file
+    if (
+        writer.supports_resume
+        and partial.get("date_partition") == date_partition
+        and partial.get("output_file") == writer.output_file.name
+        and partial.get("min_id") == min_id
+        and temp_file.exists()
+        and temp_file.stat().st_size >= partial.get("offset", 0)
+    ):
+        return partial
+
+    logger.info(f"Discarding stale partial checkpoint for {channel_name}")
+    stale_temp = partial.get("temp_file")
+    if stale_temp and stale_temp != str(temp_file):
+        Path(stale_temp).unlink(missing_ok=True)
+    checkpoints.clear_partial(channel_name)
+    return None
+
+
+def photo_size(photo) -> Optional[int]:
+    """Bytes of the size Telethon downloads for ``photo`` (its largest), if known."""
+    if getattr(photo, "video_sizes", None):
+        return None
+    sizes = []
+    for size in getattr(photo, "sizes", None) or []:
+        if isinstance(size, PhotoSizeProgressive):
+            sizes.append(max(size.sizes))
+        elif isinstance(size, PhotoSize):
+            sizes.append(size.size)
+    return max(sizes) if sizes else None
+
+
+async def download_photo(
+    client: TelegramClient,
+    message,
+    image_file,
+    retries: int = 3,
+    backoff: float = 1.0,
+    image_store: ImageStore = None,
+    rate_limiter: AdaptiveRateLimiter = None,
+) -> bool:
+    """
+    Download one photo, retrying with exponential backoff.
+
+    The photo is written to a ``.part`` file and only renamed into place
+    once it is complete, so a crash or timeout never leaves a truncated
+    ``.jpg`` that later runs would take for a finished download.
+    """
+    expected_size = photo_size(message.photo)
+    if image_store is not None:
+        if image_store.is_valid(image_file, expected_size):
+            # Already on disk from an earlier run
+            if image_store.hash_of(image_file) is None:
+                await asyncio.to_thread(image_store.register, image_file)
+            return True
+        image_store.forget(image_file)
+
+    part_file = image_file.with_name(image_file.name + ".part")
+    retries = max(1, retries)
+    for attempt in range(1, retries + 1):
+        try:
+            if rate_limiter is not None:
+                await rate_limiter.call(
+                    client.download_media, message.photo, part_file
+                )
+            else:
+                await client.download_media(message.photo, part_file)
+            if not ImageStore.is_valid(part_file, expected_size):
+                raise IOError(f"incomplete download of photo {message.id}")
+            os.replace(part_file, image_file)
+            break
+        except Exception as e:
+            part_file.unlink(missing_ok=True)
+            if attempt == retries:
+                logger.warning(
+                    f"Failed to download image {message.id} "
+                    f"after {attempt} attempts: {e}"
+                )
+                return False
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+
+    if image_store is not None:
+        await asyncio.to_thread(image_store.register, image_file)
+    return True
+
+
+async def download_worker(
+    client, queue, writer, errors, retries, backoff, image_store=None, rate_limiter=None
+):
+    """Drain photo jobs from the queue and write each finished record."""
+    while True:
+        message, record, image_file = await queue.get()
+        try:
+            if await download_photo(
+                client, message, image_file, retries, backoff, image_store, rate_limiter
+            ):
+                record["image_path"] = str(image_file)
+            writer.write(record)
+        except Exception as exc:
+            # Surfaced by scrape_channel once the queue has drained
+            errors.append(exc)
+        finally:
+            queue.task_done()
+
+
+async def scrape_channel(
+    client: TelegramClient,
+    channel: str,
+    max_messages=None,
+    checkpoints: CheckpointStore = None,
+    full_refresh: bool = False,
+    output_format: str = "json",
+    flush_every: int = 100,
+    download_workers: int = 4,
+    download_queue_size: int = 64,
+    download_retries: int = 3,
+    retry_backoff: float = 1.0,
+    image_store: ImageStore = None,
+    rate_limiter: AdaptiveRateLimiter = None,
+    checkpoint_every: int = 500,
+    compression: str = "none",
+    compression_level: int = None,
+) -> int:
+    """
+    Scrape one channel into today's landing partition.
+
+    Returns the number of records committed; a failure is logged and
+    re-raised once the partial output has been closed or discarded.
+    """
     channel_name = safe_channel_name(channel)
     date_partition = today_partition()
 
@@ -54,58 +216,279 @@ async def scrape_channel(client: TelegramClient, channel: str, max_messages=None
     messages_path.mkdir(parents=True, exist_ok=True)
     images_path.mkdir(parents=True, exist_ok=True)
 
-    output_file = messages_path / f"{channel_name}.json"
-    temp_file = output_file.with_suffix(".tmp")
+    writer = open_writer(
+        messages_path / channel_name,
+        output_format,
+        flush_every=flush_every,
+        compression=compression,
+        compression_level=compression_level,
+    )
+    output_file = writer.output_file
+
+    # Incremental mode: only fetch messages newer than the last commit,
+    # oldest first, so max_messages takes the block right after the
+    # high-water mark instead of the newest messages.
+    stored_mark = 0
+    if checkpoints is not None:
+        stored_mark = checkpoints.high_water_mark(channel_name)
+    min_id = 0 if full_refresh else stored_mark
+    reverse = bool(min_id)
+    high_water_mark = min_id
+
+    # Resume an interrupted run from its last mid-channel checkpoint
+    partial = resumable_state(
+        checkpoints, channel_name, writer, date_partition, min_id
+    )
+    offset_id = 0
+    fetched = 0
+    lowest_id = None
+    if partial:
+        high_water_mark = partial["high_water_mark"]
+        offset_id = partial["last_message_id"]
+        fetched = partial["fetched"]
+        lowest_id = partial.get("lowest_id")
+
+    logger.info(
+        f"Starting scrape for channel: {channel_name} "
+        f"(min_id={min_id}, full_refresh={full_refresh}, "
+        f"resume_from={offset_id or None})"
+    )
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, download_queue_size))
+    errors = []
+    workers = [
+        asyncio.create_task(
+            download_worker(
+                client,
+                queue,
+                writer,
+                errors,
+                download_retries,
+                retry_backoff,
+                image_store,
+                rate_limiter,
+            )
+        )
+        for _ in range(max(1, download_workers))
+    ]
 
-    results = []
-    processed = 0
+    remaining = None if max_messages is None else max(0, max_messages - fetched)
+    if rate_limiter is not None:
+        messages = rate_limiter.iter_messages(
+            client,
+            channel,
+            limit=remaining,
+            min_id=min_id,
+            offset_id=offset_id,
+            reverse=reverse,
+        )
+    else:
+        messages = client.iter_messages(
+            channel,
+            limit=remaining,
+            min_id=min_id,
+            offset_id=offset_id,
+            reverse=reverse,
+        )
 
-    logger.info(f"Starting scrape for channel: {channel_name}")
+    checkpointed = partial is not None
 
     try:
-        async for message in client.iter_messages(channel, limit=max_messages):
-            if not message.text and not message.media:
-                continue
-
-            record = {
-                "message_id": message.id,
-                "channel_name": channel_name,
-                "message_date": message.date.isoformat() if message.date else None,
-                "message_text": message.text,
-                "views": message.views or 0,
-                "forwards": message.forwards or 0,
-                "has_media": bool(message.media),
-                "image_path": None,
-            }
-
-            if isinstance(message.media, MessageMediaPhoto):
-                image_file = images_path / f"{message.id}.jpg"
-                try:
-                    await client.download_media(message.photo, image_file)
-                    record["image_path"] = str(image_file)
-                except Exception as e:
-                    logger.warning(f"Failed to download image {message.id}: {e}")
-
-            results.append(record)
-            processed += 1
+        if partial:
+            writer.resume(partial["offset"], partial["count"])
+        else:
+            writer.open()
+
+        async for message in messages:
+            high_water_mark = max(high_water_mark, message.id)
+            if lowest_id is None or message.id < lowest_id:
+                lowest_id = message.id
+            fetched += 1
+
+            if message.text or message.media:
+                record = {
+                    "message_id": message.id,
+                    "channel_name": channel_name,
+                    "message_date": (
+                        message.date.isoformat() if message.date else None
+                    ),
+                    "message_text": message.text,
+                    "views": message.views or 0,
+                    "forwards": message.forwards or 0,
+                    "has_media": bool(message.media),
+                    "image_path": None,
+                }
+
+                if isinstance(message.media, MessageMediaPhoto):
+                    # Hand the photo to the download workers; the record is
+                    # written once its download has settled.
+                    image_file = images_path / f"{message.id}.jpg"
+                    await queue.put((message, record, image_file))
+                else:
+                    writer.write(record)
+
+            if (
+                checkpoints is not None
+                and checkpoint_every
+                and writer.supports_resume
+                and fetched % checkpoint_every == 0
+            ):
+                # Everything up to this message must be on disk before the
+                # checkpoint claims it: let in-flight downloads settle.
+                await queue.join()
+                if errors:
+                    raise errors[0]
+                checkpoints.save_partial(
+                    channel_name,
+                    {
+                        "date_partition": date_partition,
+                        "output_file": writer.output_file.name,
+                        "temp_file": str(writer.temp_file),
+                        "min_id": min_id,
+                        "offset": writer.checkpoint(),
+                        "count": writer.count,
+                        "fetched": fetched,
+                        "last_message_id": message.id,
+                        "lowest_id": lowest_id,
+                        "high_water_mark": high_water_mark,
+                    },
+                )
+                checkpointed = True
+
+        await queue.join()
+        if errors:
+            raise errors[0]
 
     except Exception as exc:
+        if checkpointed:
+            # Keep the partial output for the next run to resume from
+            writer.close()
+        else:
+            writer.abort()
         logger.exception(f"Failed scraping {channel_name}: {exc}")
-        return
+        raise
+
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if image_store is not None:
+            image_store.save()
+
+    processed = writer.count
+
+    if min_id and high_water_mark == min_id:
+        writer.abort()
+        if checkpoints is not None:
+            checkpoints.clear_partial(channel_name)
+        logger.info(f"No new messages for {channel_name} since {min_id}")
+        return 0
 
     try:
-        with open(temp_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-        temp_file.replace(output_file)
+        # A second incremental run on the same day must not drop the
+        # messages committed to this partition by the first one.
+        writer.commit(carry_over=carry_over_records(output_file, min_id))
         logger.info(f"Completed channel {channel_name} | messages saved: {processed}")
     except Exception as exc:
-        logger.exception(f"Failed writing JSON for {channel_name}: {exc}")
+        writer.abort()
+        logger.exception(f"Failed writing {output_file.name} for {channel_name}: {exc}")
+        raise
+
+    # A newest-first listing cut off by max_messages above an earlier
+    # high-water mark left unfetched messages below it: keeping the old
+    # mark lets the next incremental run pick them up.
+    gap = (
+        not reverse
+        and stored_mark
+        and max_messages is not None
+        and fetched >= max_messages
+        and lowest_id is not None
+        and lowest_id > stored_mark + 1
+    )
+
+    # Advance the high-water mark only once the output file is in place
+    if checkpoints is not None and high_water_mark > min_id:
+        if gap:
+            logger.warning(
+                f"Keeping high-water mark {stored_mark} for {channel_name}: "
+                f"messages {stored_mark + 1}..{lowest_id - 1} were not fetched"
+            )
+            checkpoints.clear_partial(channel_name)
+        else:
+            checkpoints.commit(channel_name, high_water_mark)
+    return processed
+
+
+async def scrape_channels(
+    client: TelegramClient,
+    channels,
+    max_messages=None,
+    max_concurrency: int = 1,
+    channel_delay: float = 1.0,
+    **channel_options,
+):
+    """
+    Scrape several channels concurrently over one shared client.
+
+    At most ``max_concurrency`` channels are in flight at a time. A failure
+    in one channel is logged and does not cancel the others. Extra keyword
+    arguments are passed through to ``scrape_channel``. Returns the list
+    of channels that failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+
+    async def _run(channel: str):
+        async with semaphore:
+            try:
+                return await scrape_channel(
+                    client, channel, max_messages, **channel_options
+                )
+            finally:
+                # Keep the slot busy for a moment: rate-limit friendly
+                await asyncio.sleep(channel_delay)
+
+    results = await asyncio.gather(
+        *(_run(channel) for channel in channels), return_exceptions=True
+    )
+
+    failed = []
+    saved = 0
+    for channel, result in zip(channels, results):
+        if isinstance(result, Exception):
+            logger.error(f"Channel {channel} failed: {result!r}")
+            failed.append(channel)
+        else:
+            saved += result
+
+    logger.info(
+        f"Scraped {len(channels) - len(failed)}/{len(channels)} channels, "
+        f"{saved} messages saved (concurrency={max_concurrency})"
+    )
+    return failed
+
+
+def scrape_exit_code(failed, total: int, max_failed_ratio: float = None) -> int:
+    """
+    Exit status of a scrape run over ``total`` channels.
+
+    Failed channels are logged but do not fail the run, so the channels
+    that succeeded still flow on to load, YOLO and dbt. Only with
+    ``max_failed_ratio`` set and a larger share of channels failed is
+    the status 1.
+    """
+    if failed:
+        logger.warning(
+            f"{len(failed)} of {total} channels failed: {', '.join(failed)}"
+        )
+    if max_failed_ratio is None or not total:
+        return 0
+    return 1 if len(failed) / total > max_failed_ratio else 0
 
 
 # ------------------------------------------------------------------
 # Entrypoint
 # ------------------------------------------------------------------
-async def main():
+async def main(full_refresh: bool = False):
     api_id = int(os.getenv("TELEGRAM_API_ID"))
     api_hash = os.getenv("TELEGRAM_API_HASH")
 
@@ -116,14 +499,63 @@ async def main():
     # Load channels and limits from YAML via settings.get(...)
     telegram_cfg = settings.get("telegram", {})
     channels = telegram_cfg.get("channels", [])
+    output_cfg = telegram_cfg.get("output", {})
+    images_cfg = telegram_cfg.get("images", {})
+    rate_cfg = telegram_cfg.get("rate_limit", {})
     limits = settings.get("limits", {})
     max_messages = limits.get("max_messages_per_channel")
+    max_concurrency = limits.get("max_concurrent_channels", 1)
+    channel_delay = limits.get("channel_delay_seconds", 1)
+    max_failed_ratio = limits.get("max_failed_channel_ratio")
+    checkpoints = CheckpointStore(CHECKPOINT_FILE)
+    image_store = ImageStore(IMAGE_INDEX_FILE)
+    rate_limiter = AdaptiveRateLimiter(
+        rate=rate_cfg.get("requests_per_second", 20),
+        burst=rate_cfg.get("burst", 20),
+        min_rate=rate_cfg.get("min_requests_per_second", 0.5),
+        backoff_factor=rate_cfg.get("backoff_factor", 0.5),
+        recovery_step=rate_cfg.get("recovery_step", 0.05),
+        max_flood_retries=rate_cfg.get("max_flood_retries", 5),
+    )
+
+    # flood_sleep_threshold=0: every FloodWait reaches the rate limiter
+    # instead of being slept through silently inside Telethon.
+
+    async with TelegramClient(
+        "telegram_session", api_id, api_hash, flood_sleep_threshold=0
+    ) as client:
+        failed = await scrape_channels(
+            client,
+            channels,
+            max_messages=max_messages,
+            max_concurrency=max_concurrency,
+            channel_delay=channel_delay,
+            checkpoints=checkpoints,
+            full_refresh=full_refresh,
+            output_format=output_cfg.get("format", "json"),
+            flush_every=output_cfg.get("flush_every", 100),
+            checkpoint_every=output_cfg.get("checkpoint_every", 500),
+            compression=output_cfg.get("compression", "none"),
+            compression_level=output_cfg.get("compression_level"),
+            download_workers=images_cfg.get("download_workers", 4),
+            download_queue_size=images_cfg.get("queue_size", 64),
+            download_retries=images_cfg.get("download_retries", 3),
+            retry_backoff=images_cfg.get("retry_backoff_seconds", 1),
+            image_store=image_store,
+            rate_limiter=rate_limiter,
+        )
 
-    async with TelegramClient("telegram_session", api_id, api_hash) as client:
-        for channel in channels:
-            await scrape_channel(client, channel, max_messages)
-            await asyncio.sleep(1)  # rate-limit friendly
+    logger.info(f"Rate limiter stats: {rate_limiter.stats}")
+    return scrape_exit_code(failed, len(channels), max_failed_ratio)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scrape Telegram channels")
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Ignore per-channel checkpoints and re-fetch the last N messages",
+    )
+    args = parser.parse_args()
+    # A non-zero exit stops run_scraper.py and the DVC stage
+    sys.exit(asyncio.run(main(full_refresh=args.full_refresh)))
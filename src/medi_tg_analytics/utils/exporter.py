@@ -4,20 +4,15 @@ Exporter module to dump all DBT marts to CSV files.
 Place this in: medi_tg_analytics/utils/exporter.py
 """
 
-import os
 from pathlib import Path
 from datetime import datetime
 
 import pandas as pd
-import psycopg2
-from dotenv import load_dotenv
 from medi_tg_analytics.core.settings import settings
+from medi_tg_analytics.db.pool import get_engine
 
 
 def main():
-    # Load environment variables
-    load_dotenv()
-
     # Output directory for CSVs (processed/marts)
     output_dir = Path(settings.paths.DATA["processed_dir"]) / "marts"
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -31,18 +26,12 @@ def main():
 
     print(f"🚀 Export started at {datetime.now()}")
     try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-        )
+        # Shared, pooled engine from medi_tg_analytics.db
+        engine = get_engine()
 
         for table in tables:
             # Read table into Pandas DataFrame
-            df = pd.read_sql(f"SELECT * FROM {table}", conn)
+            df = pd.read_sql(f"SELECT * FROM {table}", engine)
 
             # Clean table name for CSV
             table_name = table.replace("raw_marts.", "")
@@ -56,11 +45,6 @@ def main():
         print(f"❌ Error during export: {e}")
         raise
 
-    finally:
-        if 'conn' in locals():
-            conn.close()
-            print("🔌 Database connection closed.")
-
     print(f"🎉 Export completed at {datetime.now()}")
     print(f"📂 CSVs saved in {output_dir}")
 
@@ -0,0 +1,27 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 16) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write_json(path: Path, data, indent: int = None) -> None:
+    """
+    Write ``data`` to ``path`` as JSON through a fsynced temp file that is
+    renamed into place, so a crash never leaves a half-written document.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = path.with_suffix(".tmp")
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    temp_file.replace(path)
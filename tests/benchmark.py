@@ -0,0 +1,205 @@
+"""
+Offline scraper throughput benchmark.
+
+Replays a synthetic (or recorded) channel through ``scrape_channels``
+with a ``ReplayTelegramClient`` and reports messages/s, images/s, peak
+RSS and time-to-first-write. Nothing talks to Telegram.
+
+    python -m tests.benchmark --messages 5000 --photo-ratio 0.6 \\
+        --page-latency 0.05 --download-latency 0.02 --flood-every 20
+
+``--min-messages-per-sec`` turns the run into a pass/fail check for CI;
+any failed channel fails the run regardless. Throughput only counts
+records that made it into a committed landing file.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+from medi_tg_analytics.scraping import scraper
+from medi_tg_analytics.scraping.formats import is_raw_file, read_records
+from medi_tg_analytics.scraping.rate_limit import AdaptiveRateLimiter
+
+from tests.fake_telegram import (
+    ReplayTelegramClient,
+    recorded_channel,
+    synthetic_channel,
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def committed_records(messages_dir: Path) -> int:
+    """Records in the landing files that were committed under ``messages_dir``."""
+    return sum(
+        sum(1 for _ in read_records(path))
+        for path in messages_dir.glob("*/*")
+        if is_raw_file(path)
+    )
+
+
+async def _run(client, channels, workdir, scrape_options, concurrency):
+    first_write = []
+    original_open_writer = scraper.open_writer
+
+    def timed_open_writer(*args, **kwargs):
+        writer = original_open_writer(*args, **kwargs)
+        write = writer.write
+
+        def timed_write(record):
+            if not first_write:
+                first_write.append(time.perf_counter())
+            write(record)
+
+        writer.write = timed_write
+        return writer
+
+    saved = (scraper.MESSAGES_DIR, scraper.IMAGES_DIR, scraper.open_writer)
+    scraper.MESSAGES_DIR = workdir / "telegram_messages"
+    scraper.IMAGES_DIR = workdir / "images"
+    scraper.open_writer = timed_open_writer
+    try:
+        start = time.perf_counter()
+        failed = await scraper.scrape_channels(
+            client,
+            channels,
+            max_concurrency=concurrency,
+            channel_delay=0,
+            **scrape_options,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        scraper.MESSAGES_DIR, scraper.IMAGES_DIR, scraper.open_writer = saved
+
+    ttfw = first_write[0] - start if first_write else None
+    saved = committed_records(workdir / "telegram_messages")
+    return elapsed, ttfw, failed, saved
+
+
+def run_benchmark(
+    messages=2000,
+    photo_ratio=0.5,
+    channels=1,
+    page_size=100,
+    page_latency=0.0,
+    download_latency=0.0,
+    flood_every=None,
+    flood_seconds=0,
+    concurrency=4,
+    output_format="ndjson",
+    download_workers=4,
+    replay=None,
+    seed=0,
+):
+    """Run one benchmark and return its metrics as a dict."""
+    channel_messages = (
+        recorded_channel(replay)
+        if replay
+        else synthetic_channel(messages, photo_ratio, seed)
+    )
+    client = ReplayTelegramClient(
+        channel_messages,
+        page_size=page_size,
+        page_latency=page_latency,
+        download_latency=download_latency,
+        flood_every=flood_every,
+        flood_seconds=flood_seconds,
+    )
+    limiter = AdaptiveRateLimiter(rate=1_000_000, burst=1_000_000, recovery_step=0)
+    names = [f"@bench_{i}" for i in range(channels)]
+
+    with tempfile.TemporaryDirectory(prefix="scraper-bench-") as tmp:
+        elapsed, ttfw, failed, total = asyncio.run(
+            _run(
+                client,
+                names,
+                Path(tmp),
+                dict(
+                    output_format=output_format,
+                    download_workers=download_workers,
+                    retry_backoff=0,
+                    rate_limiter=limiter,
+                ),
+                concurrency,
+            )
+        )
+
+    return {
+        "channels": channels,
+        "failed_channels": len(failed),
+        "messages": total,
+        "images": client.downloads,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(total / elapsed, 1) if elapsed else None,
+        "images_per_s": round(client.downloads / elapsed, 1) if elapsed else None,
+        "time_to_first_write_s": round(ttfw, 4) if ttfw is not None else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "flood_waits": limiter.stats["flood_waits"],
+        "requests": limiter.stats["requests"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline scraper benchmark")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--photo-ratio", type=float, default=0.5)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--page-latency", type=float, default=0.0)
+    parser.add_argument("--download-latency", type=float, default=0.0)
+    parser.add_argument("--flood-every", type=int, default=None)
+    parser.add_argument("--flood-seconds", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--format", dest="output_format", default="ndjson")
+    parser.add_argument(
+        "--replay", type=Path, default=None, help="Raw landing file to replay"
+    )
+    parser.add_argument(
+        "--min-messages-per-sec",
+        type=float,
+        default=None,
+        help="Exit non-zero when throughput falls below this floor",
+    )
+    args = parser.parse_args(argv)
+
+    floor = args.min_messages_per_sec
+    options = vars(args)
+    options.pop("min_messages_per_sec")
+    report = run_benchmark(**options)
+    print(json.dumps(report, indent=2))
+
+    if report["failed_channels"]:
+        print(
+            f"{report['failed_channels']} of {report['channels']} channels failed",
+            file=sys.stderr,
+        )
+        return 1
+    if floor is not None and report["messages_per_s"] < floor:
+        print(
+            f"Throughput {report['messages_per_s']} msg/s is below the "
+            f"{floor} msg/s floor",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Offline stand-ins for Telethon used by the scraper tests and benchmark.
+
+``ReplayTelegramClient`` serves a synthetic or recorded channel page by
+page with configurable latency and injected FloodWait errors, so the
+scraper can be exercised end to end without touching the Telegram API.
+"""
+
+import random
+import asyncio
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import MessageMediaPhoto
+
+from medi_tg_analytics.scraping.formats import read_records
+
+# --------------------------------------------------
+# Messages
+# --------------------------------------------------
+
+
+class MockMessage:
+    def __init__(
+        self,
+        message_id=1,
+        text="test message",
+        views=10,
+        forwards=2,
+        date=None,
+        media=None,
+    ):
+        self.id = message_id
+        self.text = text
+        self.views = views
+        self.forwards = forwards
+        self.date = date or datetime.utcnow()
+        self.media = media
+        self.photo = message_id if isinstance(media, MessageMediaPhoto) else None
+
+
+def synthetic_channel(count, photo_ratio=0.5, seed=0):
+    """``count`` messages, newest first, a ``photo_ratio`` share with photos."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    messages = []
+    for message_id in range(count, 0, -1):
+        has_photo = rng.random() < photo_ratio
+        messages.append(
+            MockMessage(
+                message_id=message_id,
+                text=f"Paracetamol 500mg ዋጋ {rng.randint(50, 500)} ብር #{message_id}",
+                views=rng.randint(0, 20000),
+                forwards=rng.randint(0, 300),
+                date=start + timedelta(minutes=message_id),
+                media=MessageMediaPhoto() if has_photo else None,
+            )
+        )
+    return messages
+
+
+def recorded_channel(path):
+    """Rebuild messages from a raw landing file written by the scraper."""
+    messages = []
+    for record in read_records(Path(path)):
+        date = record.get("message_date")
+        messages.append(
+            MockMessage(
+                message_id=record["message_id"],
+                text=record.get("message_text"),
+                views=record.get("views", 0),
+                forwards=record.get("forwards", 0),
+                date=datetime.fromisoformat(date) if date else None,
+                media=MessageMediaPhoto() if record.get("image_path") else None,
+            )
+        )
+    messages.sort(key=lambda m: m.id, reverse=True)
+    return messages
+
+
+# --------------------------------------------------
+# Clients
+# --------------------------------------------------
+
+
+class MockTelegramClient:
+    def __init__(self, messages):
+        self._messages = messages
+
+    async def iter_messages(
+        self, channel, limit=None, min_id=0, offset_id=0, reverse=False
+    ):
+        self.last_min_id = min_id
+        if reverse:
+            # Oldest first, starting after max(offset_id, min_id) as Telethon does
+            start = max(offset_id, min_id)
+            newer = sorted(
+                (m for m in self._messages if m.id > start), key=lambda m: m.id
+            )
+        else:
+            newer = [
+                m for m in self._messages
+                if m.id > min_id and (not offset_id or m.id < offset_id)
+            ]
+        for msg in newer[:limit]:
+            yield msg
+
+    async def download_media(self, photo, file):
+        # simulate image download
+        Path(file).write_bytes(b"fake image bytes")
+
+
+class ReplayTelegramClient(MockTelegramClient):
+    """
+    Replays one message list for every channel, one page at a time.
+
+    - ``page_latency``: seconds per ``page_size`` messages
+    - ``download_latency``: seconds per photo download
+    - ``flood_every``: raise FloodWait on every n-th page request
+    - ``image_bytes``: size of each fake photo; content is unique per photo
+    """
+
+    def __init__(
+        self,
+        messages,
+        page_size=100,
+        page_latency=0.0,
+        download_latency=0.0,
+        flood_every=None,
+        flood_seconds=0,
+        image_bytes=2048,
+    ):
+        super().__init__(messages)
+        self.page_size = page_size
+        self.page_latency = page_latency
+        self.download_latency = download_latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.image_bytes = image_bytes
+
+        self.pages = 0
+        self.downloads = 0
+        self.floods = 0
+
+    async def _page(self):
+        self.pages += 1
+        if self.flood_every and self.pages % self.flood_every == 0:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        if self.page_latency:
+            await asyncio.sleep(self.page_latency)
+
+    async def iter_messages(
+        self, channel, limit=None, min_id=0, offset_id=0, reverse=False
+    ):
+        served = 0
+        async for msg in super().iter_messages(
+            channel, limit, min_id, offset_id, reverse
+        ):
+            if served % self.page_size == 0:
+                await self._page()
+            served += 1
+            yield msg
+
+    async def download_media(self, photo, file):
+        if self.download_latency:
+            await asyncio.sleep(self.download_latency)
+        self.downloads += 1
+        header = f"{file}:{photo}".encode("utf-8")
+        padding = b"\0" * max(0, self.image_bytes - len(header))
+        Path(file).write_bytes(header + padding)
@@ -0,0 +1,116 @@
+import pytest
+
+from medi_tg_analytics.db import pool
+
+CONFIG = {
+    "host": "yaml-host",
+    "port": 5432,
+    "pool": {"min_connections": 1, "max_connections": 4},
+    "sessions": {
+        "default": {"statement_timeout": "60s"},
+        "bulk": {"synchronous_commit": "off", "work_mem": "256MB"},
+    },
+}
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_db_config_prefers_env_over_yaml(monkeypatch):
+    monkeypatch.setenv("DB_HOST", "env-host")
+    monkeypatch.delenv("DB_PORT", raising=False)
+    monkeypatch.setenv("DB_POOL_MAX", "16")
+    monkeypatch.delenv("DB_POOL_MIN", raising=False)
+
+    cfg = pool.db_config(CONFIG)
+
+    assert cfg["host"] == "env-host"
+    assert cfg["port"] == 5432
+    assert cfg["pool"] == {"min_connections": 1, "max_connections": 16}
+    # The caller's dict is left untouched
+    assert CONFIG["pool"]["max_connections"] == 4
+
+
+def test_session_profiles():
+    assert pool.session_settings("bulk", CONFIG) == {
+        "synchronous_commit": "off",
+        "work_mem": "256MB",
+    }
+    assert pool.session_settings("default", {"sessions": {}}) == {}
+    with pytest.raises(ValueError):
+        pool.session_settings("reporting", CONFIG)
+
+
+def test_apply_session_sets_and_commits_profile_settings():
+    conn = RecordingConnection()
+
+    pool.apply_session(conn, "bulk", CONFIG)
+
+    assert [params for _, params in conn.statements] == [("off",), ("256MB",)]
+    assert conn.commits == 1
+
+
+def test_engine_is_capped_at_max_connections(monkeypatch):
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    created = {}
+    monkeypatch.setattr(
+        sqlalchemy, "create_engine", lambda url, **kwargs: created.update(kwargs)
+    )
+    monkeypatch.setattr(pool, "_engine", None)
+    monkeypatch.delenv("DB_POOL_MAX", raising=False)
+    db_config = pool.db_config
+    monkeypatch.setattr(pool, "db_config", lambda: db_config(CONFIG))
+
+    pool.get_engine()
+
+    assert created["pool_size"] == 4
+    assert created["max_overflow"] == 0
+    assert created["connect_args"]["options"] == "-c statement_timeout=60s"
+
+
+class FakeEngine:
+    def __init__(self, error=None):
+        self.error = error
+
+    def connect(self):
+        if self.error:
+            raise self.error
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def exec_driver_sql(self, statement):
+        return self
+
+    def scalar(self):
+        return 1
+
+
+def test_health_check_can_probe_an_engine():
+    assert pool.health_check(FakeEngine())["ok"] is True
+    # The driver's message may name the server: it is logged, not returned
+    assert pool.health_check(
+        FakeEngine(OSError('connection to "db.internal" port 5432 refused'))
+    ) == {"ok": False, "error": "database_unavailable"}
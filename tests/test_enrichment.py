@@ -0,0 +1,426 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from medi_tg_analytics.enrichment import yolo_detect
+from medi_tg_analytics.enrichment.detection_cache import DetectionCache
+from medi_tg_analytics.enrichment.sinks import CsvSink, DetectionSink, make_sink
+
+
+# --------------------------------------------------
+# Detection cache
+# --------------------------------------------------
+
+
+def test_detection_cache_round_trips_and_follows_content(tmp_path):
+    image = tmp_path / "images" / "chan" / "1.jpg"
+    image.parent.mkdir(parents=True)
+    image.write_bytes(b"jpeg-1")
+    index = tmp_path / "cache.json"
+
+    cache = DetectionCache(index, tmp_path / "images", "yolov8n.pt|0.25")
+    assert cache.get(image) is None
+    cache.put(image, ["person", "bottle"], [0.91, 0.42])
+    cache.save()
+
+    cache = DetectionCache(index, tmp_path / "images", "yolov8n.pt|0.25")
+    assert cache.get(image) == (["person", "bottle"], [0.91, 0.42])
+
+    # A touched file keeps its result; new content is a miss
+    stat = image.stat()
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(image) is not None
+    image.write_bytes(b"jpeg-2")
+    assert cache.get(image) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_detection_cache_misses_on_new_fingerprint_and_prunes(tmp_path):
+    images = tmp_path / "images"
+    kept, gone = images / "a" / "1.jpg", images / "b" / "2.jpg"
+    for i, path in enumerate((kept, gone)):
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"jpeg-%d" % i)
+
+    cache = DetectionCache(tmp_path / "cache.json", images, "old")
+    cache.put(kept, [], [])
+    cache.put(gone, ["cup"], [0.5])
+    cache.prune([kept])
+    cache.save()
+
+    cache = DetectionCache(tmp_path / "cache.json", images, "old")
+    assert cache.get(kept) == ([], [])
+    assert cache.get(gone) is None
+
+    assert DetectionCache(tmp_path / "cache.json", images, "new").get(kept) is None
+
+
+def test_detection_cache_tracks_published_rows_per_path(tmp_path):
+    images = tmp_path / "images"
+    first, copy = images / "a" / "1.jpg", images / "b" / "2.jpg"
+    for path in (first, copy):
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"same photo")
+
+    cache = DetectionCache(tmp_path / "cache.json", images, "model")
+    cache.put(first, ["cup"], [0.5])
+    cache.mark_published([first], "v1")
+    cache.save()
+
+    cache = DetectionCache(tmp_path / "cache.json", images, "model")
+    assert cache.is_published(first, "v1")
+    # Same content under another path, or another row version: not published
+    assert not cache.is_published(copy, "v1")
+    assert not cache.is_published(first, "v2")
+    first.write_bytes(b"new photo")
+    assert not cache.is_published(first, "v1")
+
+
+# --------------------------------------------------
+# yolo_detect
+# --------------------------------------------------
+
+
+def test_importing_yolo_detect_does_not_load_the_model():
+    code = (
+        "import sys, medi_tg_analytics.enrichment.yolo_detect as y; "
+        "print(y._model, [m for m in ('ultralytics', 'torch') if m in sys.modules])"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert out.stdout.strip() == "None []"
+
+
+@pytest.mark.parametrize(
+    "classes, category",
+    [
+        (["person", "bottle"], "promotional"),
+        (["cup", "cup"], "product_display"),
+        (["person"], "lifestyle"),
+        (["car"], "other"),
+        ([], "other"),
+    ],
+)
+def test_classify_image(classes, category):
+    assert yolo_detect.classify_image(classes) == category
+
+
+def test_detection_rows_take_ids_from_the_image_path(tmp_path):
+    rows = yolo_detect.detection_rows(
+        tmp_path / "tikvahpharma" / "1234.jpg", ["person", "jar"], [0.912345, 0.5]
+    )
+    assert [(r["message_id"], r["channel_name"]) for r in rows] == [
+        ("1234", "tikvahpharma")
+    ] * 2
+    assert [r["confidence_score"] for r in rows] == [0.9123, 0.5]
+    assert {r["image_category"] for r in rows} == {"promotional"}
+    assert rows[0]["model_version"] == yolo_detect.MODEL_NAME
+
+
+class FakeModel:
+    """Fails any batch containing a frame equal to ``bad``."""
+
+    names = {0: "person", 1: "car"}
+
+    def __init__(self, bad=None):
+        self.calls = []
+        self.kwargs = None
+        self.bad = bad
+
+    def __call__(self, frames, **kwargs):
+        self.calls.append(len(frames))
+        self.kwargs = kwargs
+        if any(frame == self.bad for frame in frames):
+            raise RuntimeError("corrupt image")
+        return [
+            SimpleNamespace(
+                names={0: "person"},
+                boxes=[SimpleNamespace(cls=[0], conf=[0.5 + frame / 10])],
+            )
+            for frame in frames
+        ]
+
+
+def test_infer_batch_isolates_a_failing_image(monkeypatch, tmp_path):
+    model = FakeModel(bad=2)
+    monkeypatch.setattr(yolo_detect, "_model", model)
+    paths = [tmp_path / f"{i}.jpg" for i in range(4)]
+
+    detections = yolo_detect.infer_batch(paths, [0, 1, 2, 3])
+
+    assert model.calls == [4, 1, 1, 1, 1]
+    assert model.kwargs["classes"] == [0]
+    assert sorted(detections) == [paths[0], paths[1], paths[3]]
+    assert detections[paths[1]] == (["person"], [0.6])
+
+
+def test_prefetch_batches_keeps_order_and_drops_undecodable_images(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    import numpy as np
+
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"{i}.jpg"
+        cv2.imwrite(str(path), np.full((8, 8, 3), i * 40, dtype=np.uint8))
+        paths.append(path)
+    paths[3].write_bytes(b"not a jpeg")
+
+    timings = {}
+    batches = list(
+        yolo_detect.prefetch_batches(
+            [paths[:2], paths[2:4], paths[4:]], timings, workers=2, depth=1
+        )
+    )
+
+    assert [b[0] for b in batches] == [paths[:2], [paths[2]], [paths[4]]]
+    assert batches[2][1][0].shape == (8, 8, 3)
+    assert set(timings) == {"decode", "wait"}
+
+
+def test_top_detections_keeps_the_best_row_of_every_category_class():
+    detected = ["car", "car", "cup", "car", "person", "cup"]
+    confidences = [0.95, 0.9, 0.8, 0.7, 0.3, 0.2]
+
+    assert yolo_detect.top_detections(detected, confidences, 2) == (
+        ["car", "car", "cup", "person"],
+        [0.95, 0.9, 0.8, 0.3],
+    )
+    assert yolo_detect.top_detections(detected, confidences, None) == (
+        detected,
+        confidences,
+    )
+
+
+def test_detection_rows_categorise_before_the_limit(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_detect, "MAX_DETECTIONS", 1)
+    rows = yolo_detect.detection_rows(
+        tmp_path / "chan" / "1.jpg", ["car", "person", "bottle"], [0.9, 0.5, 0.4]
+    )
+    assert [r["detected_class"] for r in rows] == ["car", "person", "bottle"]
+    assert {r["image_category"] for r in rows} == {"promotional"}
+
+    rows = yolo_detect.detection_rows(
+        tmp_path / "chan" / "1.jpg", ["car", "car", "bottle"], [0.9, 0.5, 0.4]
+    )
+    assert [r["detected_class"] for r in rows] == ["car", "bottle"]
+
+
+def test_predict_args_map_the_allow_list_to_class_ids(monkeypatch):
+    monkeypatch.setattr(yolo_detect, "CLASSES", ["bottle", "person"])
+    model = SimpleNamespace(names={0: "person", 1: "car", 39: "bottle"})
+    assert yolo_detect.predict_args(model)["classes"] == [0, 39]
+
+    # A model without any of the classes is not filtered to nothing
+    other = SimpleNamespace(names={0: "pill", 1: "box"})
+    assert "classes" not in yolo_detect.predict_args(other)
+
+    monkeypatch.setattr(yolo_detect, "CLASSES", None)
+    assert yolo_detect.predict_args(model) == yolo_detect.PREDICT_ARGS
+
+
+class ThreadShardPool(ThreadPoolExecutor):
+    """Runs shards in threads, where the monkeypatched fakes are visible."""
+
+    def __init__(self, max_workers, mp_context=None, initializer=None, initargs=()):
+        super().__init__(max_workers=max_workers)
+
+
+def fake_shard_inference(images, batch_size, timings):
+    if any(p.stem == "bad" for p in images):
+        raise RuntimeError("corrupt image")
+    # Shard 0 finishes last
+    if images[0].stem == "0":
+        time.sleep(0.2)
+    timings["inference"] = timings.get("inference", 0.0) + 1
+    yield {p: (["cup"], [0.5]) for p in images}
+
+
+def test_infer_sharded_merges_in_shard_order_and_raises_last(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_detect, "ProcessPoolExecutor", ThreadShardPool)
+    monkeypatch.setattr(yolo_detect, "infer_images", fake_shard_inference)
+    monkeypatch.setattr(yolo_detect, "SHARD_DIR", tmp_path / "shards")
+    monkeypatch.setattr(yolo_detect, "BACKEND", "torch")
+    images = [tmp_path / f"{i}.jpg" for i in range(6)]
+
+    timings = {}
+    merged = list(yolo_detect.infer_sharded(images, 3, 4, timings, threads=1))
+    assert [sorted(p.stem for p in part) for part in merged] == [
+        ["0", "3"], ["1", "4"], ["2", "5"]
+    ]
+    assert timings["inference"] == 3
+    assert list((tmp_path / "shards").iterdir()) == []
+
+    # A failed shard: the others are still handed over, then it raises
+    images[4] = tmp_path / "bad.jpg"
+    seen = []
+    with pytest.raises(RuntimeError, match="shard 1: corrupt image"):
+        for part in yolo_detect.infer_sharded(images, 3, 4, {}, threads=1):
+            seen.append(sorted(p.stem for p in part))
+    assert seen == [["0", "3"], ["2", "5"]]
+    assert list((tmp_path / "shards").iterdir()) == []
+
+
+def test_merge_shards_removes_parts_left_unread(tmp_path):
+    parts = {}
+    for index in (1, 0):
+        parts[index] = tmp_path / f"shard-{index:03d}.json"
+        parts[index].write_text(json.dumps({f"/img/{index}.jpg": [["cup"], [0.5]]}))
+
+    merged = yolo_detect.merge_shards(parts, [])
+    assert next(merged) == {Path("/img/0.jpg"): (["cup"], [0.5])}
+    merged.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_compare_detections_ignores_order_and_small_drift():
+    reference = (["person", "cup"], [0.91, 0.40])
+    assert yolo_detect.compare_detections(reference, (["cup", "person"], [0.405, 0.91])) == []
+    assert yolo_detect.compare_detections(reference, (["person"], [0.91])) == [
+        "classes ['cup', 'person'] != ['person']"
+    ]
+    assert yolo_detect.compare_detections(reference, (["person", "cup"], [0.8, 0.4])) == [
+        "person confidence 0.9100 != 0.8000"
+    ]
+
+
+def test_onnx_backend_is_exported_once_and_matches_torch(monkeypatch, tmp_path):
+    pytest.importorskip("ultralytics")
+    pytest.importorskip("onnxruntime")
+    cv2 = pytest.importorskip("cv2")
+    import numpy as np
+
+    # Untrained weights from the architecture file: no download needed
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(yolo_detect, "MODEL_NAME", "yolov8n.yaml")
+    monkeypatch.setattr(yolo_detect, "MODELS_DIR", tmp_path / "models")
+    monkeypatch.setitem(yolo_detect.PREDICT_ARGS, "conf", 0.0001)
+
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(2):
+        path = tmp_path / f"{i}.jpg"
+        cv2.imwrite(str(path), rng.integers(0, 255, (96, 128, 3), dtype=np.uint8))
+        images.append(path)
+
+    exported = yolo_detect.exported_model("onnx")
+    assert exported.suffix == ".onnx"
+    assert exported.parent.parent == tmp_path / "models"
+    assert yolo_detect.exported_model("onnx") == exported
+
+    assert yolo_detect.check_parity(images, "onnx") == []
+
+
+# --------------------------------------------------
+# Sinks
+# --------------------------------------------------
+
+
+class ListSink(DetectionSink):
+    name = "list"
+
+    def open(self):
+        self.state = "open"
+        return self
+
+    def __init__(self, fail_on_write=None, incremental=False):
+        self.chunks = []
+        self.keys = []
+        self.state = "new"
+        self.fail_on_write = fail_on_write
+        self.incremental = incremental
+
+    def write(self, rows, images):
+        if len(self.chunks) == self.fail_on_write:
+            raise RuntimeError("sink down")
+        self.chunks.append(list(rows))
+        self.keys.extend(images)
+
+    def commit(self):
+        self.state = "committed"
+
+    def abort(self):
+        self.state = "aborted"
+
+
+def test_write_detections_streams_chunks_in_image_order(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_detect, "SINK_BATCH_ROWS", 3)
+    images = [tmp_path / "chan" / f"{i}.jpg" for i in range(4)]
+    paths_of = {p: [p] for p in images}
+    paths_of[images[0]].append(tmp_path / "other" / "9.jpg")
+    batches = [
+        {images[0]: (["person"], [0.9]), images[1]: (["cup", "cup"], [0.5, 0.4])},
+        {images[3]: (["jar"], [0.3])},
+    ]
+    sink = ListSink()
+
+    assert yolo_detect.write_detections([sink], batches, paths_of, set()) == 5
+    assert sink.state == "committed"
+    assert [len(chunk) for chunk in sink.chunks] == [4, 1]
+    assert [(r["channel_name"], r["message_id"]) for r in sink.chunks[0]] == [
+        ("chan", "0"), ("other", "9"), ("chan", "1"), ("chan", "1")
+    ]
+
+
+def test_incremental_sinks_only_get_changed_paths(tmp_path):
+    images = [tmp_path / "chan" / f"{i}.jpg" for i in range(3)]
+    copy = tmp_path / "other" / "9.jpg"
+    paths_of = {images[0]: [images[0], copy], images[1]: [images[1]], images[2]: [images[2]]}
+    full, incremental = ListSink(), ListSink(incremental=True)
+
+    def batches(changed):
+        yield {images[0]: (["person"], [0.9])}
+        # Inferred while the sinks are already being written
+        changed.add(images[2])
+        yield {images[1]: (["cup"], [0.5]), images[2]: ([], [])}
+
+    changed = {copy}
+    yolo_detect.write_detections(
+        [full, incremental], batches(changed), paths_of, changed
+    )
+
+    assert len(full.keys) == 4
+    assert [r["message_id"] for chunk in full.chunks for r in chunk] == ["0", "9", "1"]
+    # An image without detections is still handed over, so its old rows go
+    assert [key[:2] for key in incremental.keys] == [("9", "other"), ("2", "chan")]
+    assert [r["message_id"] for chunk in incremental.chunks for r in chunk] == ["9"]
+
+
+def test_a_failing_sink_aborts_every_sink(tmp_path):
+    images = [tmp_path / "chan" / "1.jpg"]
+    csv_sink = CsvSink(tmp_path / "out.csv")
+    broken = ListSink(fail_on_write=0)
+
+    with pytest.raises(RuntimeError, match="sink down"):
+        yolo_detect.write_detections(
+            [csv_sink, broken], [{images[0]: (["cup"], [0.5])}], {images[0]: images}, set()
+        )
+
+    assert broken.state == "aborted"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_csv_sink_writes_header_and_rows(tmp_path):
+    sink = CsvSink(tmp_path / "interim" / "yolo_image_detections.csv").open()
+    image = tmp_path / "chan" / "7.jpg"
+    sink.write(
+        yolo_detect.detection_rows(image, ["cup"], [0.5]), [yolo_detect.image_key(image)]
+    )
+    sink.commit()
+
+    lines = sink.path.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == (
+        "message_id,channel_name,detected_class,confidence_score,"
+        "image_category,model_version"
+    )
+    assert lines[1].startswith("7,chan,cup,0.5,product_display,")
+
+    with pytest.raises(ValueError, match="Unknown sink"):
+        make_sink("parquet", sink.path)
@@ -0,0 +1,435 @@
+import io
+import os
+import json
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from medi_tg_analytics.scraping.formats import _iter_json_array, open_writer
+from medi_tg_analytics.utils.files import file_sha256
+from medi_tg_analytics.loading.manifest import LoadManifest
+from medi_tg_analytics.loading.partitions import MessagePartitions, month_of
+from medi_tg_analytics.loading.yolo_csv_to_db import (
+    csv_columns,
+    prepare_tables,
+    publish_stage,
+)
+from medi_tg_analytics.loading import load_raw_to_postgres
+from medi_tg_analytics.loading.load_raw_to_postgres import (
+    copy_payload,
+    dedupe_rows,
+    list_raw_files,
+    parse_messages,
+    pending_files,
+)
+
+# --------------------------------------------------
+# Helpers
+# --------------------------------------------------
+
+
+def make_record(message_id, text="hello"):
+    return {
+        "message_id": message_id,
+        "channel_name": "testchannel",
+        "message_date": "2025-01-01T10:00:00+00:00",
+        "message_text": text,
+        "views": 5,
+        "forwards": 1,
+        "has_media": False,
+        "image_path": None,
+    }
+
+
+# --------------------------------------------------
+# Parsing raw landing files
+# --------------------------------------------------
+
+
+def test_parse_messages_reads_json_and_ndjson(tmp_path):
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text(json.dumps([make_record(1), make_record(2)]), encoding="utf-8")
+
+    writer = open_writer(tmp_path / "streamed", "ndjson").open()
+    writer.write(make_record(3))
+    writer.write(make_record(4, text="ሰላም"))
+    writer.commit()
+
+    assert [p.name for p in list_raw_files(tmp_path)] == [
+        "legacy.json",
+        "streamed.jsonl",
+    ]
+
+    assert [r[0] for r in parse_messages(legacy)] == [1, 2]
+
+    rows = parse_messages(tmp_path / "streamed.jsonl")
+    assert [r[0] for r in rows] == [3, 4]
+    assert rows[1][3] == "ሰላም"
+    assert rows[1][4:7] == (5, 1, False)
+
+
+def test_json_array_writer_output_is_valid_json(tmp_path):
+    writer = open_writer(tmp_path / "channel", "json").open()
+    for i in range(3):
+        writer.write(make_record(i))
+    writer.commit()
+
+    with open(tmp_path / "channel.json", "r", encoding="utf-8") as f:
+        assert [r["message_id"] for r in json.load(f)] == [0, 1, 2]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_json_arrays_are_read_element_by_element(chunk_size):
+    records = [make_record(i, text="ሰላም ], {") for i in range(5)]
+    text = json.dumps([12345, *records, [1, 2], -0.5e3], indent=1)
+    items = _iter_json_array(io.StringIO(text), chunk_size=chunk_size)
+    assert list(items) == [12345, *records, [1, 2], -0.5e3]
+    assert list(_iter_json_array(io.StringIO(" [ ] "))) == []
+
+    # Elements before a tear are still yielded
+    torn = text[: text.index('"message_id": 3')]
+    items = _iter_json_array(io.StringIO(torn), chunk_size=chunk_size)
+    assert next(items) == 12345
+    assert [next(items)["message_id"] for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(json.JSONDecodeError):
+        next(items)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+@pytest.mark.parametrize("fmt", ["json", "ndjson"])
+def test_compressed_writer_resumes_and_round_trips(tmp_path, fmt, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    writer = open_writer(tmp_path / "channel", fmt, compression=compression).open()
+    for i in range(3):
+        writer.write(make_record(i))
+    offset, count = writer.checkpoint(), writer.count
+    writer.write(make_record(99))
+    writer.close()  # crash after the checkpoint
+
+    writer = open_writer(tmp_path / "channel", fmt, compression=compression)
+    writer.resume(offset, count)
+    writer.write(make_record(3, text="ሰላም"))
+    output_file = writer.commit()
+
+    assert output_file.name.endswith({"gzip": ".gz", "zstd": ".zst"}[compression])
+    assert list_raw_files(tmp_path) == [output_file]
+
+    rows = parse_messages(output_file)
+    assert [r[0] for r in rows] == [0, 1, 2, 3]
+    assert rows[-1][3] == "ሰላም"
+
+
+@pytest.mark.parametrize(
+    "compression, level", [("none", None), ("zstd", None), ("none", 3), ("snappy", 3)]
+)
+def test_parquet_partition_has_typed_schema(tmp_path, compression, level):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    # compression_level is ignored by codecs without levels
+    writer = open_writer(
+        tmp_path / "channel",
+        "parquet",
+        compression=compression,
+        compression_level=level,
+    )
+    writer.open()
+    writer.write(make_record(1))
+    writer.write(dict(make_record(2), message_date=None, image_path="a/2.jpg"))
+    output_file = writer.commit()
+
+    assert output_file.name == "channel.parquet"
+    # A Parquet file has no resumable byte offsets to checkpoint
+    assert not writer.supports_resume and not hasattr(writer, "checkpoint")
+    assert list_raw_files(tmp_path) == [output_file]
+
+    schema = pq.read_schema(output_file)
+    assert str(schema.field("message_date").type) == "timestamp[us, tz=UTC]"
+    assert str(schema.field("message_id").type) == "int64"
+
+    rows = parse_messages(output_file)
+    assert [r[0] for r in rows] == [1, 2]
+    # Loader receives real datetimes, normalised to naive UTC
+    assert rows[0][2] == datetime(2025, 1, 1, 10, 0)
+    assert rows[1][2] is None
+    assert rows[1][7] == "a/2.jpg"
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "parquet"])
+def test_message_dates_are_naive_utc_in_every_format(tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    writer = open_writer(tmp_path / "channel", fmt).open()
+    writer.write(dict(make_record(1), message_date="2025-01-31T23:30:00-02:00"))
+    writer.write(dict(make_record(2), message_date="2025-02-01T01:00:00"))
+    rows = parse_messages(writer.commit())
+
+    assert [r[2] for r in rows] == [
+        datetime(2025, 2, 1, 1, 30),
+        datetime(2025, 2, 1, 1, 0),
+    ]
+    assert copy_payload(rows[:1]).split("\t")[2] == "2025-02-01 01:30:00"
+
+
+# --------------------------------------------------
+# COPY payload
+# --------------------------------------------------
+
+
+def test_copy_payload_escapes_text_format():
+    rows = [
+        (1, "chan", "2025-01-01T10:00:00+00:00", "tab\there\nline \\ ሰላም", 5, 0, True, None),
+        (2, "chan", None, None, 0, 0, False, "chan/2.jpg"),
+    ]
+
+    lines = copy_payload(rows).split("\n")
+
+    assert lines[0].split("\t") == [
+        "1", "chan", "2025-01-01T10:00:00+00:00",
+        "tab\\there\\nline \\\\ ሰላም", "5", "0", "t", "\\N",
+    ]
+    assert lines[1].split("\t") == [
+        "2", "chan", "\\N", "\\N", "0", "0", "f", "chan/2.jpg",
+    ]
+    assert lines[2] == ""
+
+
+def test_dedupe_rows_keeps_highest_counts_per_message():
+    rows = [
+        (1, "chan", None, "a", 10, 1, False, None),
+        (2, "chan", None, "b", 3, 0, False, None),
+        (1, "chan", None, "a", 25, 2, False, None),
+        (1, "chan", None, "a", None, None, False, None),
+        (1, "other", None, "c", 1, 0, False, None),
+    ]
+
+    deduped = dedupe_rows(rows)
+
+    # message ids are only unique within a channel
+    assert [(r[1], r[0], r[4], r[5]) for r in deduped] == [
+        ("chan", 1, 25, 2),
+        ("chan", 2, 3, 0),
+        ("other", 1, 1, 0),
+    ]
+
+
+# --------------------------------------------------
+# Partitions
+# --------------------------------------------------
+
+
+class RecordingCursor:
+    rowcount = 0
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.cur = RecordingCursor()
+        self.commits = 0
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+        self.cur.statements.append("COMMIT")
+
+
+def test_month_of_accepts_iso_strings_and_datetimes():
+    assert month_of("2025-01-31T23:59:59+00:00") == date(2025, 1, 1)
+    assert month_of(datetime(2024, 12, 5, tzinfo=timezone.utc)) == date(2024, 12, 1)
+    assert month_of(None) is None
+
+
+def test_partitions_are_created_once_per_month():
+    cur = RecordingCursor()
+    partitions = MessagePartitions()
+    partitions.known = {"telegram_messages_p2025_01"}
+
+    batch = [
+        (1, "chan", "2025-01-10T10:00:00+00:00"),
+        (2, "chan", "2024-12-31T10:00:00+00:00"),
+        (3, "chan", "2024-12-01T00:00:00+00:00"),
+    ]
+    partitions.ensure(cur, batch)
+    partitions.ensure(cur, batch)
+
+    creates = [s for s in cur.statements if s.startswith("CREATE TABLE")]
+    assert creates == [
+        "CREATE TABLE IF NOT EXISTS raw.telegram_messages_p2024_12 "
+        "PARTITION OF raw.telegram_messages "
+        "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01');"
+    ]
+    assert "pg_advisory_xact_lock" in cur.statements[0]
+
+
+def test_hash_sub_partitions_split_each_month_by_channel():
+    cur = RecordingCursor()
+    MessagePartitions(hash_partitions=2).ensure_months(cur, [date(2025, 3, 1)])
+
+    assert cur.statements[1].endswith(
+        "FOR VALUES FROM ('2025-03-01') TO ('2025-04-01') "
+        "PARTITION BY HASH (channel_name);"
+    )
+    assert [s.split()[5] for s in cur.statements[2:]] == [
+        "raw.telegram_messages_p2025_03_h0",
+        "raw.telegram_messages_p2025_03_h1",
+    ]
+
+
+def test_partitions_are_created_in_their_own_transaction_mid_file(tmp_path):
+    raw_file = tmp_path / "chan.jsonl"
+    dates = ["2025-01-30T10:00:00", "2025-01-31T23:00:00", "2025-02-01T01:00:00"]
+    raw_file.write_text(
+        "".join(
+            json.dumps(dict(make_record(i), message_date=d)) + "\n"
+            for i, d in enumerate(dates)
+        )
+    )
+    conn = RecordingConnection()
+    partitions = MessagePartitions()
+    loaded = []
+
+    def load_batch(cur, batch, on_conflict):
+        loaded.append([row[0] for row in batch])
+        cur.execute("LOAD")
+
+    manifest = SimpleNamespace(record=lambda cur, path, rows: None)
+
+    load_raw_to_postgres.load_file(
+        conn, raw_file, load_batch, partitions, manifest, batch_size=2, commit="file"
+    )
+
+    # The second batch crosses into February: the January rows are
+    # committed before its DDL, which never shares a transaction with rows
+    assert loaded == [[0, 1], [2]]
+    transactions = " ".join(conn.cur.statements).split("COMMIT")
+    ddl = [t for t in transactions if "CREATE TABLE" in t]
+    assert len(ddl) == 2
+    assert all("LOAD" not in t for t in ddl)
+    assert conn.cur.statements[-2:] == ["LOAD", "COMMIT"]
+
+
+# --------------------------------------------------
+# Load manifest
+# --------------------------------------------------
+
+
+def test_manifest_skips_unchanged_files_and_rehashes_touched_ones(tmp_path):
+    raw_file = tmp_path / "2025-01-01" / "chan.jsonl"
+    raw_file.parent.mkdir()
+    raw_file.write_text('{"message_id": 1}\n', encoding="utf-8")
+
+    manifest = LoadManifest(tmp_path)
+    assert not manifest.is_current(raw_file)
+
+    stat = raw_file.stat()
+    manifest.entries[manifest.key(raw_file)] = {
+        "file_size": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+        "content_hash": file_sha256(raw_file),
+    }
+    assert manifest.key(raw_file) == "2025-01-01/chan.jsonl"
+    assert manifest.is_current(raw_file)
+    assert manifest.touched == []
+
+    # Same bytes, new mtime: hashed, still current, stat queued for refresh
+    os.utime(raw_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.is_current(raw_file)
+    assert manifest.touched == [raw_file]
+
+    # Same size, different content
+    raw_file.write_text('{"message_id": 2}\n', encoding="utf-8")
+    assert not manifest.is_current(raw_file)
+
+
+def test_pending_files_lists_changed_files_oldest_partition_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(load_raw_to_postgres, "RAW_DIR", tmp_path)
+    for day in ("2025-01-02", "2025-01-01"):
+        (tmp_path / day).mkdir()
+        (tmp_path / day / "chan.jsonl").write_text('{"message_id": 1}\n')
+    (tmp_path / "2025-01-01" / "notes.txt").write_text("not raw")
+
+    manifest = LoadManifest(tmp_path)
+    loaded = tmp_path / "2025-01-01" / "chan.jsonl"
+    stat = loaded.stat()
+    manifest.entries[manifest.key(loaded)] = {
+        "file_size": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+        "content_hash": file_sha256(loaded),
+    }
+
+    files, skipped = pending_files(manifest)
+    assert [manifest.key(f) for f in files] == ["2025-01-02/chan.jsonl"]
+    assert skipped == 1
+
+    files, skipped = pending_files(manifest, force=True)
+    assert [manifest.key(f) for f in files] == [
+        "2025-01-01/chan.jsonl",
+        "2025-01-02/chan.jsonl",
+    ]
+    assert skipped == 0
+
+
+# --------------------------------------------------
+# YOLO detections CSV
+# --------------------------------------------------
+
+
+def test_csv_columns_accepts_old_and_new_detection_files(tmp_path):
+    old = tmp_path / "old.csv"
+    old.write_text(
+        "message_id,channel_name,detected_class,confidence_score,image_category\n"
+    )
+    new = tmp_path / "new.csv"
+    new.write_text(
+        "message_id,channel_name,detected_class,confidence_score,"
+        "image_category,model_version\n"
+    )
+    bad = tmp_path / "bad.csv"
+    bad.write_text("message_id,channel_name;DROP TABLE x\n")
+
+    assert csv_columns(old)[-1] == "image_category"
+    assert csv_columns(new)[-1] == "model_version"
+    with pytest.raises(ValueError):
+        csv_columns(bad)
+
+
+@pytest.mark.parametrize("has_column", [False, True])
+def test_model_version_is_backfilled_only_when_the_column_is_added(has_column):
+    cur = RecordingCursor()
+    cur.fetchone = lambda: (1,) if has_column else None
+    prepare_tables(cur)
+
+    backfills = [s for s in cur.statements if "WHERE model_version IS NULL" in s]
+    assert len(backfills) == (0 if has_column else 1)
+    assert any(s.startswith("CREATE INDEX IF NOT EXISTS") for s in cur.statements)
+
+
+def test_only_changed_images_are_deleted_and_reinserted():
+    cur = RecordingCursor()
+
+    # The CSV lists every image: only images new to the model are appended
+    publish_stage(cur, "append")
+    assert "DELETE" not in cur.statements[-1]
+    assert "WHERE NOT EXISTS" in cur.statements[-1]
+
+    # The Postgres sink stages only new or changed images and replaces them
+    publish_stage(cur, "replace_images")
+    assert cur.statements[-1].startswith(
+        "DELETE FROM raw.yolo_image_detections t USING"
+    )
+
+    with pytest.raises(ValueError):
+        publish_stage(cur, "upsert")
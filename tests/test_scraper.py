@@ -1,12 +1,25 @@
+import os
 import json
+import asyncio
 import pytest
 from pathlib import Path
 from datetime import datetime
 
+from telethon.errors import FloodWaitError
+from telethon.tl.types import MessageMediaPhoto, PhotoSize
+
+from tests.benchmark import main as benchmark_main, run_benchmark
+from tests.fake_telegram import MockMessage, MockTelegramClient
+from medi_tg_analytics.scraping.checkpoints import CheckpointStore
+from medi_tg_analytics.scraping.formats import read_records
+from medi_tg_analytics.scraping.image_store import ImageStore
+from medi_tg_analytics.scraping.rate_limit import AdaptiveRateLimiter
 from medi_tg_analytics.scraping.scraper import (
     safe_channel_name,
     today_partition,
     scrape_channel,
+    scrape_channels,
+    scrape_exit_code,
 )
 
 # --------------------------------------------------
@@ -29,36 +42,145 @@ def test_today_partition_format():
 # Mocks
 # --------------------------------------------------
 
-class MockMessage:
-    def __init__(
-        self,
-        message_id=1,
-        text="test message",
-        views=10,
-        forwards=2,
-        date=None,
-        media=None,
+class SlowPhotoClient(MockTelegramClient):
+    """Downloads take a while and some photos fail a few times first."""
+
+    def __init__(self, messages, delay=0.02, failures=None):
+        super().__init__(messages)
+        self._delay = delay
+        self._failures = dict(failures or {})
+        self.attempts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def download_media(self, photo, file):
+        self.attempts[photo] = self.attempts.get(photo, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self._delay)
+            if self._failures.get(photo, 0) > 0:
+                self._failures[photo] -= 1
+                raise ConnectionError("connection reset")
+            Path(file).write_bytes(b"fake image bytes")
+        finally:
+            self.in_flight -= 1
+
+
+class TelegramPhoto:
+    """A photo whose largest size is ``size`` bytes."""
+
+    def __init__(self, size):
+        self.sizes = [PhotoSize(type="y", w=1, h=1, size=size)]
+
+
+class FloodingClient(MockTelegramClient):
+    """Raises FloodWait once after ``flood_after`` messages of a listing."""
+
+    def __init__(self, messages, flood_after=3, seconds=0):
+        super().__init__(messages)
+        self._flood_after = flood_after
+        self._seconds = seconds
+        self.calls = 0
+
+    async def iter_messages(
+        self, channel, limit=None, min_id=0, offset_id=0, reverse=False
     ):
-        self.id = message_id
-        self.text = text
-        self.views = views
-        self.forwards = forwards
-        self.date = date or datetime.utcnow()
-        self.media = media
-        self.photo = None
+        self.calls += 1
+        served = 0
+        async for msg in super().iter_messages(
+            channel, limit, min_id, offset_id, reverse
+        ):
+            if self.calls == 1 and served == self._flood_after:
+                raise FloodWaitError(request=None, capture=self._seconds)
+            served += 1
+            yield msg
+
 
+class RepeatedFloodClient(MockTelegramClient):
+    """Raises FloodWait after ``flood_after`` messages of each of the first ``floods`` listings."""
 
-class MockTelegramClient:
-    def __init__(self, messages):
-        self._messages = messages
+    def __init__(self, messages, flood_after, floods):
+        super().__init__(messages)
+        self._flood_after = flood_after
+        self._floods = floods
+        self.calls = 0
 
-    async def iter_messages(self, channel, limit=None):
-        for msg in self._messages[:limit]:
+    async def iter_messages(
+        self, channel, limit=None, min_id=0, offset_id=0, reverse=False
+    ):
+        self.calls += 1
+        served = 0
+        async for msg in super().iter_messages(
+            channel, limit, min_id, offset_id, reverse
+        ):
+            if self.calls <= self._floods and served == self._flood_after:
+                raise FloodWaitError(request=None, capture=0)
+            served += 1
             yield msg
 
-    async def download_media(self, photo, file):
-        # simulate image download
-        Path(file).write_bytes(b"fake image bytes")
+
+class CrashingClient(MockTelegramClient):
+    """Drops the connection after ``crash_after`` messages on the first listing."""
+
+    def __init__(self, messages, crash_after):
+        super().__init__(messages)
+        self._crash_after = crash_after
+        self.offsets = []
+
+    async def iter_messages(
+        self, channel, limit=None, min_id=0, offset_id=0, reverse=False
+    ):
+        self.offsets.append(offset_id)
+        served = 0
+        async for msg in super().iter_messages(
+            channel, limit, min_id, offset_id, reverse
+        ):
+            if len(self.offsets) == 1 and served == self._crash_after:
+                raise ConnectionError("network blip")
+            served += 1
+            yield msg
+
+
+class MultiChannelClient(MockTelegramClient):
+    """Serves a different message list per channel and tracks concurrency."""
+
+    def __init__(self, channels, delay=0.01):
+        super().__init__([])
+        self._channels = channels
+        self._delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def iter_messages(
+        self, channel, limit=None, min_id=0, offset_id=0, reverse=False
+    ):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            messages = self._channels[channel]
+            if isinstance(messages, Exception):
+                raise messages
+            for msg in messages[:limit]:
+                await asyncio.sleep(self._delay)
+                yield msg
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture
+def raw_dirs(tmp_path, monkeypatch):
+    """Point the scraper's output directories at a temp tree."""
+    messages_dir = tmp_path / "data" / "raw" / "telegram_messages"
+    images_dir = tmp_path / "data" / "raw" / "images"
+
+    monkeypatch.setattr(
+        "medi_tg_analytics.scraping.scraper.MESSAGES_DIR", messages_dir
+    )
+    monkeypatch.setattr(
+        "medi_tg_analytics.scraping.scraper.IMAGES_DIR", images_dir
+    )
+    return messages_dir, images_dir
 
 
 # --------------------------------------------------
@@ -120,3 +242,370 @@ async def test_scrape_channel_writes_json(tmp_path, monkeypatch):
     assert data[0]["message_text"] == "hello"
     assert data[1]["views"] == 10
     assert data[0]["channel_name"] == "testchannel"
+
+
+@pytest.mark.asyncio
+async def test_scrape_channels_isolates_failures_and_caps_concurrency(raw_dirs):
+    messages_dir, _ = raw_dirs
+
+    client = MultiChannelClient(
+        {
+            "@one": [MockMessage(message_id=i) for i in range(1, 4)],
+            "@broken": RuntimeError("channel is private"),
+            "@two": [MockMessage(message_id=i) for i in range(1, 3)],
+            "@three": [MockMessage(message_id=1)],
+        }
+    )
+
+    failed = await scrape_channels(
+        client,
+        ["@one", "@broken", "@two", "@three"],
+        max_messages=10,
+        max_concurrency=2,
+        channel_delay=0,
+    )
+
+    assert failed == ["@broken"]
+
+    partition = messages_dir / today_partition()
+    assert sorted(p.name for p in partition.glob("*.json")) == [
+        "one.json",
+        "three.json",
+        "two.json",
+    ]
+    assert client.max_in_flight == 2
+
+
+
+def test_failed_channels_only_fail_the_run_above_the_configured_ratio():
+    assert scrape_exit_code([], 4) == 0
+    assert scrape_exit_code(["@broken"], 4) == 0
+    assert scrape_exit_code(["@broken"], 4, max_failed_ratio=0.5) == 0
+    assert scrape_exit_code(["@a", "@b", "@c"], 4, max_failed_ratio=0.5) == 1
+
+
+@pytest.mark.asyncio
+async def test_scrape_channel_incremental_uses_high_water_mark(raw_dirs, tmp_path):
+    messages_dir, _ = raw_dirs
+    checkpoints = CheckpointStore(tmp_path / "state" / "checkpoints.json")
+
+    # Telegram yields newest first
+    client = MockTelegramClient(
+        [MockMessage(message_id=i, text=f"m{i}") for i in (3, 2, 1)]
+    )
+    await scrape_channel(client, "@TestChannel", 10, checkpoints=checkpoints)
+    assert client.last_min_id == 0
+    assert checkpoints.high_water_mark("testchannel") == 3
+
+    # Second run the same day only fetches the delta and keeps earlier rows
+    client._messages.insert(0, MockMessage(message_id=4, text="m4"))
+    await scrape_channel(client, "@TestChannel", 10, checkpoints=checkpoints)
+    assert client.last_min_id == 3
+
+    output_file = messages_dir / today_partition() / "testchannel.json"
+    with open(output_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    assert sorted(r["message_id"] for r in data) == [1, 2, 3, 4]
+
+    # The checkpoint survives a restart of the process
+    reloaded = CheckpointStore(tmp_path / "state" / "checkpoints.json")
+    assert reloaded.high_water_mark("testchannel") == 4
+
+    # Full refresh ignores the stored high-water mark
+    await scrape_channel(
+        client, "@TestChannel", 10, checkpoints=checkpoints, full_refresh=True
+    )
+    assert client.last_min_id == 0
+
+
+@pytest.mark.asyncio
+async def test_incremental_backlog_larger_than_max_messages(raw_dirs, tmp_path):
+    messages_dir, _ = raw_dirs
+    checkpoints = CheckpointStore(tmp_path / "state" / "checkpoints.json")
+    checkpoints.commit("testchannel", 10)
+    client = MockTelegramClient(
+        [MockMessage(message_id=i, text=f"m{i}") for i in range(30, 0, -1)]
+    )
+
+    # Each capped run takes the next block after the high-water mark
+    for mark in (15, 20, 25):
+        assert await scrape_channel(
+            client, "@TestChannel", 5, checkpoints=checkpoints
+        ) == 5
+        assert checkpoints.high_water_mark("testchannel") == mark
+
+    output_file = messages_dir / today_partition() / "testchannel.json"
+    ids = sorted(r["message_id"] for r in read_records(output_file))
+    assert ids == list(range(11, 26))
+
+    # A capped full refresh fetches 26..30 only: 21..25 stay behind the
+    # mark it must not advance past
+    checkpoints.commit("testchannel", 20)
+    await scrape_channel(
+        client, "@TestChannel", 5, checkpoints=checkpoints, full_refresh=True
+    )
+    assert checkpoints.high_water_mark("testchannel") == 20
+
+
+@pytest.mark.asyncio
+async def test_scrape_channel_streams_ndjson(raw_dirs):
+    messages_dir, _ = raw_dirs
+
+    client = MockTelegramClient(
+        [MockMessage(message_id=i, text=f"ሰላም {i}") for i in range(1, 6)]
+    )
+    await scrape_channel(
+        client, "@TestChannel", 10, output_format="ndjson", flush_every=2
+    )
+
+    partition = messages_dir / today_partition()
+    output_file = partition / "testchannel.jsonl"
+    assert output_file.exists()
+    assert not (partition / "testchannel.tmp").exists()
+
+    lines = output_file.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[0])["message_text"] == "ሰላም 1"
+
+
+@pytest.mark.asyncio
+async def test_scrape_channel_downloads_photos_in_parallel(raw_dirs):
+    messages_dir, images_dir = raw_dirs
+
+    messages = [
+        MockMessage(message_id=i, text=None, media=MessageMediaPhoto())
+        for i in range(1, 9)
+    ]
+    messages.append(MockMessage(message_id=9, text="text only"))
+    # Photo 2 recovers on the third attempt, photo 5 never does
+    client = SlowPhotoClient(messages, failures={2: 2, 5: 10})
+
+    await scrape_channel(
+        client,
+        "@TestChannel",
+        20,
+        download_workers=4,
+        download_queue_size=2,
+        download_retries=3,
+        retry_backoff=0,
+    )
+
+    assert client.max_in_flight > 1
+    assert client.attempts[2] == 3
+    assert client.attempts[5] == 3
+
+    output_file = messages_dir / today_partition() / "testchannel.json"
+    with open(output_file, "r", encoding="utf-8") as f:
+        data = {r["message_id"]: r for r in json.load(f)}
+
+    assert sorted(data) == list(range(1, 10))
+    assert data[2]["image_path"] == str(images_dir / "testchannel" / "2.jpg")
+    assert data[5]["image_path"] is None
+    assert data[9]["image_path"] is None
+
+
+@pytest.mark.asyncio
+async def test_scrape_channel_skips_existing_and_links_duplicate_images(
+    raw_dirs, tmp_path
+):
+    _, images_dir = raw_dirs
+    store = ImageStore(tmp_path / "state" / "image_index.json")
+
+    # Same promo photo posted in two channels
+    photo = [MockMessage(message_id=7, text=None, media=MessageMediaPhoto())]
+    client = SlowPhotoClient(photo, delay=0)
+
+    await scrape_channel(client, "@ChannelA", 10, image_store=store)
+    await scrape_channel(client, "@ChannelB", 10, image_store=store)
+    assert client.attempts[7] == 2
+
+    first = images_dir / "channela" / "7.jpg"
+    second = images_dir / "channelb" / "7.jpg"
+    assert first.read_bytes() == second.read_bytes()
+    assert os.path.samefile(first, second)
+
+    # A rerun finds the file on disk and does not download it again
+    await scrape_channel(client, "@ChannelA", 10, image_store=store)
+    assert client.attempts[7] == 2
+
+    reloaded = ImageStore(tmp_path / "state" / "image_index.json")
+    assert reloaded.hash_of(first) == reloaded.hash_of(second) is not None
+
+
+@pytest.mark.asyncio
+async def test_truncated_images_are_downloaded_again(raw_dirs, tmp_path):
+    messages_dir, images_dir = raw_dirs
+    store = ImageStore(tmp_path / "state" / "image_index.json")
+    messages = [
+        MockMessage(message_id=i, text=None, media=MessageMediaPhoto()) for i in (7, 8)
+    ]
+    # The mock client writes 16 bytes; photo 8 claims to be larger
+    for message, size in zip(messages, (16, 100)):
+        message.photo = TelegramPhoto(size)
+
+    # Cut short by a crash of an earlier run
+    image = images_dir / "testchannel" / "7.jpg"
+    image.parent.mkdir(parents=True)
+    image.write_bytes(b"fake")
+
+    client = SlowPhotoClient(messages, delay=0)
+    await scrape_channel(
+        client, "@TestChannel", 10, image_store=store, retry_backoff=0
+    )
+
+    assert client.attempts[messages[0].photo] == 1
+    assert image.read_bytes() == b"fake image bytes"
+    # A download that keeps coming up short never lands as a .jpg
+    assert client.attempts[messages[1].photo] == 3
+    assert sorted(p.name for p in image.parent.iterdir()) == ["7.jpg"]
+
+    output_file = messages_dir / today_partition() / "testchannel.json"
+    with open(output_file, "r", encoding="utf-8") as f:
+        paths = {r["message_id"]: r["image_path"] for r in json.load(f)}
+    assert paths == {7: str(image), 8: None}
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_resumes_after_flood_wait(raw_dirs):
+    messages_dir, _ = raw_dirs
+    limiter = AdaptiveRateLimiter(rate=1000, burst=10, min_rate=1)
+
+    client = FloodingClient(
+        [MockMessage(message_id=i) for i in range(10, 0, -1)], flood_after=4
+    )
+    await scrape_channel(client, "@TestChannel", 100, rate_limiter=limiter)
+
+    output_file = messages_dir / today_partition() / "testchannel.json"
+    with open(output_file, "r", encoding="utf-8") as f:
+        ids = [r["message_id"] for r in json.load(f)]
+
+    # Resumed below the last yielded id: no duplicates, no gaps
+    assert ids == list(range(10, 0, -1))
+    assert client.calls == 2
+    assert limiter.stats["flood_waits"] == 1
+    assert limiter.rate < 1000
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_only_caps_flood_waits_without_progress():
+    messages = [MockMessage(message_id=i) for i in range(20, 0, -1)]
+    limiter = AdaptiveRateLimiter(rate=1000, burst=10, max_flood_retries=2)
+
+    # Five spaced FloodWaits: each retry makes progress, so none is fatal
+    client = RepeatedFloodClient(messages, flood_after=3, floods=5)
+    ids = [m.id async for m in limiter.iter_messages(client, "chan")]
+    assert ids == list(range(20, 0, -1))
+    assert limiter.stats["flood_waits"] == 5
+
+    # Back-to-back FloodWaits on the same page still give up
+    client = RepeatedFloodClient(messages, flood_after=0, floods=5)
+    with pytest.raises(FloodWaitError):
+        [m async for m in limiter.iter_messages(client, "chan")]
+    assert client.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_throttles_to_configured_rate():
+    limiter = AdaptiveRateLimiter(rate=50, burst=1, recovery_step=0)
+
+    async def noop():
+        return "ok"
+
+    start = asyncio.get_running_loop().time()
+    results = [await limiter.call(noop) for _ in range(6)]
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert results == ["ok"] * 6
+    assert limiter.stats["requests"] == 6
+    assert limiter.stats["waits"] >= 4
+    assert elapsed >= 0.08
+
+
+@pytest.mark.asyncio
+async def test_scrape_channel_resumes_from_mid_channel_checkpoint(raw_dirs, tmp_path):
+    messages_dir, _ = raw_dirs
+    checkpoints = CheckpointStore(tmp_path / "state" / "checkpoints.json")
+    messages = [MockMessage(message_id=i) for i in range(20, 0, -1)]
+
+    # Dies after 8 messages; the last checkpoint was taken at message 6
+    client = CrashingClient(messages, crash_after=8)
+    options = dict(
+        checkpoints=checkpoints, output_format="ndjson", checkpoint_every=3
+    )
+    with pytest.raises(ConnectionError):
+        await scrape_channel(client, "@TestChannel", 100, **options)
+
+    partition = messages_dir / today_partition()
+    assert not (partition / "testchannel.jsonl").exists()
+    assert (partition / "testchannel.tmp").exists()
+    partial = CheckpointStore(checkpoints.path).partial("testchannel")
+    assert partial["last_message_id"] == 15
+    assert partial["count"] == 6
+
+    # The restarted run continues below the checkpoint
+    assert await scrape_channel(client, "@TestChannel", 100, **options) == 20
+    assert client.offsets == [0, 15]
+
+    lines = (partition / "testchannel.jsonl").read_text().splitlines()
+    ids = [json.loads(line)["message_id"] for line in lines]
+    assert ids == list(range(20, 0, -1))
+    assert checkpoints.partial("testchannel") is None
+    assert checkpoints.high_water_mark("testchannel") == 20
+
+
+# --------------------------------------------------
+# Benchmark harness (offline, replayable client)
+# --------------------------------------------------
+
+
+def test_benchmark_overlaps_downloads_and_survives_flood_waits():
+    report = run_benchmark(
+        messages=200,
+        photo_ratio=0.5,
+        channels=2,
+        page_size=50,
+        page_latency=0.005,
+        download_latency=0.01,
+        flood_every=3,
+        concurrency=2,
+        download_workers=8,
+    )
+
+    assert report["failed_channels"] == 0
+    assert report["messages"] == 400
+    assert report["images"] > 100
+    assert report["flood_waits"] >= 1
+    assert report["time_to_first_write_s"] is not None
+    # Serial downloads alone would need images * 10ms
+    assert report["elapsed_s"] < report["images"] * 0.01 / 2
+
+
+def test_benchmark_fails_when_a_channel_fails(capsys):
+    # Every page request floods: the limiter gives up on both channels
+    report = run_benchmark(messages=50, channels=2, page_size=10, flood_every=1)
+    assert report["failed_channels"] == 2
+    assert report["messages"] == 0
+
+    assert benchmark_main(["--messages", "50", "--flood-every", "1"]) == 1
+    assert "1 of 1 channels failed" in capsys.readouterr().err
+
+
+@pytest.mark.asyncio
+async def test_scrape_channel_writes_parquet_partition(raw_dirs, tmp_path):
+    pytest.importorskip("pyarrow")
+    messages_dir, _ = raw_dirs
+    checkpoints = CheckpointStore(tmp_path / "state" / "checkpoints.json")
+
+    client = MockTelegramClient([MockMessage(message_id=i) for i in (3, 2, 1)])
+    await scrape_channel(
+        client,
+        "@TestChannel",
+        10,
+        checkpoints=checkpoints,
+        output_format="parquet",
+        checkpoint_every=1,
+    )
+
+    output_file = messages_dir / today_partition() / "testchannel.parquet"
+    assert [r["message_id"] for r in read_records(output_file)] == [3, 2, 1]
+    assert checkpoints.high_water_mark("testchannel") == 3